@@ -1,125 +1,74 @@
 import argparse
-import glob
+import asyncio
+import multiprocessing
 import os
-import platform
-import shutil
-import socket
-import subprocess
-import sys
 import time
-from datetime import datetime
-from urllib.parse import urlparse
 
 import inquirer
 
-# [FIX] Move pyzipper to top-level import.
-# This ensures PyInstaller sees it and bundles it inside the exe.
-import pyzipper
-from dotenv import load_dotenv
-
 # Import user configuration
 import config
+import engine
 
 
-def run_command(command, env, log_name):
-    """Helper to run subprocess commands."""
-    print(f"Generating {log_name}...")
-    try:
-        # Check if the executable exists before running to avoid silent failures
-        exe_name = command[0]
-        if shutil.which(exe_name) is None:
-            print(f"❌ Error: Executable '{exe_name}' not found in PATH.")
-            return False
-
-        subprocess.run(command, check=True, capture_output=True, text=True, env=env, timeout=1200)
-        print(f"✔ {log_name} created.")
-    except subprocess.TimeoutExpired:
-        print(f"❌ Error: {log_name} process timed out.")
-        return False
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Error generating {log_name}:")
-        print(e.stderr)
-        return False
-    except Exception as e:
-        print(f"❌ Unexpected error: {e}")
-        return False
-    return True
-
-
-def compress_and_encrypt(source_folder, output_zip, password):
-    """Zips a folder with AES-256 encryption using pyzipper."""
-    print(f"\n📦 Compressing and Encrypting to {output_zip}...")
-
-    try:
-        with pyzipper.AESZipFile(output_zip, "w", compression=pyzipper.ZIP_LZMA, encryption=pyzipper.WZ_AES) as zf:
-            if password:
-                zf.setpassword(password.encode("utf-8"))
-                zf.setencryption(pyzipper.WZ_AES, nbits=256)
-
-            for root, _, files in os.walk(source_folder):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, os.path.dirname(source_folder))
-                    zf.write(file_path, arcname)
-
-        print("✔ Secured Archive Created.")
-        return True
-    except Exception as e:
-        print(f"❌ Error during compression: {e}")
-        return False
-
-
-def cleanup_backups(backup_dir, project_prefix):
-    """Retention policy logic."""
-    print("\n🧹 Running Retention Cleanup...")
-
-    search_pattern = os.path.join(backup_dir, f"{project_prefix}_backup_*.zip")
-    files = glob.glob(search_pattern)
-
-    # Filter out Permanent backups
-    deletable_files = [f for f in files if "_P.zip" not in f]
-
-    # Sort by modification time (newest first)
-    deletable_files.sort(key=os.path.getmtime, reverse=True)
-
-    files_deleted = 0
-
-    # Check Count Limit
-    if config.MAX_BACKUPS_PER_PROJECT > 0:
-        while len(deletable_files) > config.MAX_BACKUPS_PER_PROJECT:
-            file_to_remove = deletable_files.pop()
-            try:
-                os.remove(file_to_remove)
-                print(f"   🗑️ Deleted (Count Limit): {os.path.basename(file_to_remove)}")
-                files_deleted += 1
-            except OSError as e:
-                print(f"   ⚠️ Could not delete {file_to_remove}: {e}")
-
-    # Check Age Limit
-    if config.RETENTION_DAYS > 0:
-        now = time.time()
-        age_limit_seconds = config.RETENTION_DAYS * 86400
-
-        for file_path in deletable_files[:]:
-            file_age = now - os.path.getmtime(file_path)
-            if file_age > age_limit_seconds:
-                try:
-                    os.remove(file_path)
-                    print(f"   🗑️ Deleted (Old Age): {os.path.basename(file_path)}")
-                    files_deleted += 1
-                except OSError as e:
-                    print(f"   ⚠️ Could not delete {file_path}: {e}")
-
-    if files_deleted == 0:
-        print("   No cleanup required.")
+async def print_events(events):
+    """Prints the engine's log events and returns the final "done" event."""
+    done = {"ok": False}
+    async for event in events:
+        if event["type"] == "log":
+            print(event["message"], flush=True)
+        elif event["type"] == "done":
+            done = event
+    return done
 
 
 def main():
     # --- ARGUMENT PARSING FOR HEADLESS / CI MODE ---
     parser = argparse.ArgumentParser(description="Supabase Backup Tool")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        default="backup",
+        choices=["backup", "plan", "drill", "extract", "scrub"],
+        help=(
+            "'backup' (default) runs a backup, 'plan' only estimates it, 'drill' test-restores an archive, "
+            "'extract' pulls one table out of a per-table archive, 'scrub' re-verifies stored archives"
+        ),
+    )
     parser.add_argument("--env", help="Name of the .env file to use (e.g., .production.env)")
     parser.add_argument("--permanent", action="store_true", help="Flag backup as permanent")
     parser.add_argument("--non-interactive", action="store_true", help="Skip interactive prompts")
+    parser.add_argument(
+        "--force-full", action="store_true", help="Always dump roles and schema, ignoring catalog fingerprints"
+    )
+    parser.add_argument(
+        "--pick", choices=["newest", "random"], default="newest", help="Drill/extract: which backup to use"
+    )
+    parser.add_argument("--backup", help="Drill/extract: use this archive instead of picking one")
+    parser.add_argument("--target-uri", help="Drill: maintenance DB URI of the local PostgreSQL to restore into")
+    parser.add_argument("--keep", action="store_true", help="Drill: keep the restored database afterwards")
+    parser.add_argument("--jobs", type=int, default=engine.DRILL_JOBS, help="Drill/scrub: parallel jobs")
+    parser.add_argument(
+        "--layout", choices=["single", "per_table"], help="Archive layout (default: archive_layout in settings.json)"
+    )
+    parser.add_argument(
+        "--parquet",
+        action="store_true",
+        default=None,
+        help="Also export every table to Parquet inside the archive (needs pyarrow; default: settings.json)",
+    )
+    parser.add_argument("--table", help="Extract: schema.table to extract")
+    parser.add_argument("--output", help="Extract: output folder (default: backups/extracted)")
+    parser.add_argument(
+        "--rate-limit", type=float, help="Scrub: disk read limit in MB/s, 0 = unlimited (default: settings.json)"
+    )
+    parser.add_argument("--rescan", action="store_true", help="Scrub: also re-check archives that passed before")
+    parser.add_argument(
+        "--profile", action="store_true", help="Profile each phase and write a report next to the archive"
+    )
+    parser.add_argument(
+        "--profile-hook", help="Optional sampling profiler hook as module:function (called with the phase name)"
+    )
     args = parser.parse_args()
 
     if not args.non_interactive:
@@ -142,13 +91,7 @@ def main():
     # If pyzipper is missing, the exe would fail to start entirely (which is better than a silent crash).
 
     # 2. Select .env file from 'envs/' folder
-    # [FIX] Use sys.executable path to find 'envs' folder reliably in both dev and exe modes
-    if getattr(sys, "frozen", False):
-        base_app_dir = os.path.dirname(sys.executable)
-    else:
-        base_app_dir = os.path.dirname(os.path.abspath(__file__))
-
-    env_dir = os.path.join(base_app_dir, "envs")
+    env_dir = engine.ENV_DIR
 
     if not os.path.exists(env_dir):
         if args.non_interactive:
@@ -182,18 +125,11 @@ def main():
             exit(1)
         selected_env_filename = answers["env_file"]
 
-    selected_env_path = os.path.join(env_dir, selected_env_filename)
-
-    # --- PREFIX LOGIC ---
-    project_prefix = selected_env_filename.replace(".env", "")
-    if project_prefix.startswith("."):
-        project_prefix = project_prefix[1:]
-
     # --- PERMANENT TOGGLE ---
     is_permanent = False
     if args.permanent:
         is_permanent = True
-    elif not args.non_interactive and config.ALLOW_PERMANENT_TAGGING:
+    elif args.command == "backup" and not args.non_interactive and config.ALLOW_PERMANENT_TAGGING:
         q_perm = [
             inquirer.Confirm(
                 "permanent", message="Mark this backup as PERMANENT (protect from cleanup)?", default=False
@@ -202,119 +138,51 @@ def main():
         ans_perm = inquirer.prompt(q_perm)
         is_permanent = ans_perm["permanent"] if ans_perm else False
 
-    # 3. Folder Setup
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    suffix = "_P" if is_permanent else ""
-    folder_name = f"{project_prefix}_backup_{timestamp}{suffix}" if project_prefix else f"backup_{timestamp}{suffix}"
-
-    base_backups_dir = os.path.join(base_app_dir, "backups")
-    if not os.path.exists(base_backups_dir):
-        os.makedirs(base_backups_dir)
-
-    target_folder = os.path.join(base_backups_dir, folder_name)
-    if not os.path.exists(target_folder):
-        os.makedirs(target_folder)
-
-    # 4. Load Credentials
-    load_dotenv(dotenv_path=selected_env_path)
-
-    supabase_db_uri = os.getenv("SUPABASE_DB_URI")
-    supabase_url = os.getenv("SUPABASE_URL")
-    db_password = os.getenv("DB_PASSWORD")
-    zip_password = os.getenv("ZIP_PASSWORD")
-
-    env = os.environ.copy()
-    common_args = []
-
-    # Connection Logic
-    if supabase_db_uri:
-        if not args.non_interactive:
-            print(f"Connecting using URI from {selected_env_filename}...")
-        common_args = ["--dbname", supabase_db_uri, "--no-password"]
-    else:
-        if not args.non_interactive:
-            print(f"Connecting using URL/Pass from {selected_env_filename}...")
-        if not supabase_url or not db_password:
-            print("Error: Credentials missing in .env")
+    # 3. Run through the engine and print its progress events
+    options = {
+        "permanent": is_permanent,
+        "force_full": args.force_full,
+        "pick": args.pick,
+        "backup": args.backup,
+        "target_uri": args.target_uri,
+        "keep": args.keep,
+        "jobs": args.jobs,
+        "layout": args.layout,
+        "parquet": args.parquet,
+        "table": args.table,
+        "output": args.output,
+        "rate_limit": args.rate_limit,
+        "rescan": args.rescan,
+        "profile": args.profile,
+        "profile_hook": args.profile_hook,
+    }
+    runner = {
+        "backup": engine.run_backup,
+        "plan": engine.run_plan,
+        "drill": engine.run_drill,
+        "extract": engine.run_extract,
+        "scrub": engine.run_scrub,
+    }[args.command]
+    done = asyncio.run(print_events(runner(selected_env_filename, options)))
+
+    if args.command == "backup":
+        print("\n---------------------------------")
+        print("Process Finished.")
+
+    if not done["ok"]:
+        if done.get("error") and not args.non_interactive:
             input("Press Enter to exit...")
-            exit(1)
-        try:
-            parsed = urlparse(supabase_url)
-            if parsed.hostname is None:
-                raise ValueError("Invalid URL: Hostname not found.")
-
-            host = f"db.{parsed.hostname.split('.')[0]}.supabase.co"
-            # Attempt generic DNS resolve
-            try:
-                socket.gethostbyname(host)
-            except socket.gaierror:
-                pass
-            common_args = ["-h", host, "-p", "5432", "-U", "postgres", "--no-password"]
-            env["PGPASSWORD"] = db_password
-        except Exception as e:
-            print(f"Connection Error: {e}")
-            input("Press Enter to exit...")
-            exit(1)
-
-    # 5. Execute Dumps
-    is_win = platform.system() == "Windows"
-    pg_dump = "pg_dump.exe" if is_win else "pg_dump"
-    pg_dumpall = "pg_dumpall.exe" if is_win else "pg_dumpall"
-
-    roles_file = os.path.join(target_folder, "roles.sql")
-    schema_file = os.path.join(target_folder, "schema.sql")
-    data_file = os.path.join(target_folder, "data.sql")
-
-    print("\n--- Starting Backup ---")
-
-    # Roles
-    run_command(
-        [pg_dumpall] + common_args + ["--clean", "--if-exists", "--roles-only", "-f", roles_file], env, "roles.sql"
-    )
-
-    # Schema
-    s_args = common_args if supabase_db_uri else common_args + ["-d", "postgres"]
-    run_command([pg_dump] + s_args + ["--schema-only", "-f", schema_file], env, "schema.sql")
-
-    # Data
-    d_args = common_args if supabase_db_uri else common_args + ["-d", "postgres"]
-    run_command(
-        [pg_dump] + d_args + ["--data-only", "--schema=public", "--schema=cron", "--schema=auth", "-f", data_file],
-        env,
-        "data.sql",
-    )
-
-    # 6. Compression & Encryption
-    zip_filename = os.path.join(base_backups_dir, f"{folder_name}.zip")
-
-    if not zip_password:
-        print("\n⚠️  WARNING: ZIP_PASSWORD not found. Archive will NOT be encrypted.")
-
-    success = compress_and_encrypt(target_folder, zip_filename, zip_password)
-
-    # 7. Cleanup Raw Folder
-    if success:
-        try:
-            shutil.rmtree(target_folder)
-            print(f"✔ Raw files removed. Backup secured at: {zip_filename}")
-        except OSError as e:
-            print(f"⚠️ Error removing raw folder: {e}")
-    else:
-        print("❌ Encryption failed. Keeping raw folder for safety.")
-
-    # 8. Run Retention Policy
-    cleanup_backups(base_backups_dir, project_prefix)
-
-    print("\n---------------------------------")
-    print("Process Finished.")
+        exit(1)
 
     # [FIX] Keep window open if running manually so user can see result
-    if not args.non_interactive:
+    if args.command == "backup" and not args.non_interactive:
         print("Closing in 5 seconds...")
         time.sleep(5)
 
 
 if __name__ == "__main__":
+    # Scrub workers are separate processes; the frozen exe must hand them off instead of starting the CLI again
+    multiprocessing.freeze_support()
     try:
         main()
     except Exception as e:
@@ -14,13 +14,36 @@ SETTINGS_FILE = os.path.join(BASE_DIR, "settings.json")
 MAX_BACKUPS_PER_PROJECT = 5
 RETENTION_DAYS = 30
 ALLOW_PERMANENT_TAGGING = True
+FULL_REFRESH_DAYS = 7
+POLICIES = {}
+ARCHIVE_LAYOUT = "single"
+SCRUB_RATE_LIMIT_MB = 50
+SCRUB_INTERVAL_HOURS = 0
+PARQUET_EXPORT = False
+DESTINATIONS = []
+
 
 # 3. Load from JSON if available
-try:
-    if os.path.exists(SETTINGS_FILE):
-        with open(SETTINGS_FILE, "r") as f:
-            data = json.load(f)
-            MAX_BACKUPS_PER_PROJECT = data.get("max_backups", 5)
-            RETENTION_DAYS = data.get("retention_days", 30)
-except Exception as e:
-    print(f"Warning: Could not load settings.json ({e}). Using defaults.")
+def load():
+    """(Re)reads settings.json. The engine calls this before every run, so GUI edits apply without a restart."""
+    global MAX_BACKUPS_PER_PROJECT, RETENTION_DAYS, FULL_REFRESH_DAYS, POLICIES, ARCHIVE_LAYOUT
+    global SCRUB_RATE_LIMIT_MB, SCRUB_INTERVAL_HOURS, PARQUET_EXPORT, DESTINATIONS
+
+    try:
+        if os.path.exists(SETTINGS_FILE):
+            with open(SETTINGS_FILE, "r") as f:
+                data = json.load(f)
+                MAX_BACKUPS_PER_PROJECT = data.get("max_backups", 5)
+                RETENTION_DAYS = data.get("retention_days", 30)
+                FULL_REFRESH_DAYS = data.get("full_refresh_days", 7)
+                POLICIES = data.get("policies", {})
+                ARCHIVE_LAYOUT = data.get("archive_layout", "single")
+                SCRUB_RATE_LIMIT_MB = data.get("scrub_rate_limit_mb", 50)
+                SCRUB_INTERVAL_HOURS = data.get("scrub_interval_hours", 0)
+                PARQUET_EXPORT = data.get("parquet_export", False)
+                DESTINATIONS = data.get("destinations", [])
+    except Exception as e:
+        print(f"Warning: Could not load settings.json ({e}). Using defaults.")
+
+
+load()
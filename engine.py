@@ -0,0 +1,2449 @@
+"""Backup engine: the dump/compress/retention pipeline as an importable library.
+
+The CLI (backup.py) and the GUI (gui.py) both drive the engine through the async
+API at the bottom of this module (run_backup, run_plan, run_drill, ...). Each call runs
+the pipeline in a worker thread and yields progress events:
+
+    {"type": "log", "message": "..."}
+    {"type": "phase", "phase": "schema"}
+    {"type": "phase_done", "phase": "schema", "seconds": 1.2}
+    {"type": "progress", "phase": "data", "bytes": 1048576}
+    {"type": "done", "ok": True, "result": {...}}
+
+Cancelling the task that iterates the events kills the running pg_dump/psql
+process and stops the pipeline at the next checkpoint.
+"""
+
+import asyncio
+import contextvars
+import cProfile
+import glob
+import hashlib
+import importlib
+import io
+import json
+import os
+import platform
+import pstats
+import queue
+import random
+import re
+import shutil
+import socket
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from urllib.parse import urlparse, urlunparse
+
+# [FIX] Move pyzipper to top-level import.
+# This ensures PyInstaller sees it and bundles it inside the exe.
+import pyzipper
+from dotenv import dotenv_values
+
+# Reflink copies for replication (not available on Windows)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Optional: only needed for the Parquet export, so the release exe does not have to bundle it.
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Import user configuration
+import config
+
+ENV_DIR = os.path.join(config.BASE_DIR, "envs")
+BACKUPS_DIR = os.path.join(config.BASE_DIR, "backups")
+HISTORY_DIR = os.path.join(BACKUPS_DIR, ".history")
+
+IS_WIN = platform.system() == "Windows"
+PG_DUMP = "pg_dump.exe" if IS_WIN else "pg_dump"
+PG_DUMPALL = "pg_dumpall.exe" if IS_WIN else "pg_dumpall"
+PSQL = "psql.exe" if IS_WIN else "psql"
+
+
+class BackupError(Exception):
+    """A run could not proceed (missing credentials, no disk space, ...)."""
+
+
+class BackupCancelled(Exception):
+    """The caller cancelled the run."""
+
+
+class _Run:
+    """Per-run state shared between the async caller and the worker thread."""
+
+    def __init__(self, loop, queue):
+        self.loop = loop
+        self.queue = queue
+        self.cancelled = threading.Event()
+        self.processes = set()
+
+    def emit(self, event):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+
+    def cancel(self):
+        self.cancelled.set()
+        for proc in list(self.processes):
+            try:
+                proc.kill()
+            except OSError:
+                pass
+
+
+# The run the current thread is working for. None when the engine is used synchronously.
+_current_run = contextvars.ContextVar("current_run", default=None)
+_current_phase = contextvars.ContextVar("current_phase", default=None)
+
+
+def check_cancelled():
+    run = _current_run.get()
+    if run and run.cancelled.is_set():
+        raise BackupCancelled()
+
+
+def log(message=""):
+    """Routes a progress line to the caller's event stream (or stdout outside of a run)."""
+    run = _current_run.get()
+    if run is None:
+        print(message, flush=True)
+        return
+    run.emit({"type": "log", "message": str(message)})
+
+
+def progress(nbytes):
+    """Reports how many bytes the current phase has written so far (for throughput displays)."""
+    run = _current_run.get()
+    if run:
+        run.emit({"type": "progress", "phase": _current_phase.get(), "bytes": nbytes})
+
+
+# Per-run profiler state when --profile is on. None otherwise.
+_current_profiler = contextvars.ContextVar("current_profiler", default=None)
+PROFILE_TOP_N = 20
+
+# tracemalloc and the os.times() children counters are process-wide, so a profiled run must be
+# the only run in the process: it would stop or reset another run's tracing and be credited with
+# the CPU time of its pg_dump children.
+_active_runs = {}  # _Run -> whether it is profiled
+_active_runs_lock = threading.Lock()
+
+
+def _enter_run(run, profiled):
+    with _active_runs_lock:
+        if any(_active_runs.values()):
+            raise BackupError("A profiled run is in progress and needs the engine to itself. Try again later.")
+        if profiled and _active_runs:
+            raise BackupError("--profile needs the engine to itself, but another run is active. Try again later.")
+        _active_runs[run] = profiled
+
+
+def _leave_run(run):
+    with _active_runs_lock:
+        _active_runs.pop(run, None)
+
+
+@contextmanager
+def phase(name):
+    """Marks a pipeline phase in the event stream and times it (and profiles it in --profile mode)."""
+    run = _current_run.get()
+    if run:
+        check_cancelled()
+        run.emit({"type": "phase", "phase": name})
+    _current_phase.set(name)
+    started = time.time()
+    profiler = _current_profiler.get()
+    if profiler is None:
+        yield
+    else:
+        with _profiled(profiler, name):
+            yield
+    if run:
+        run.emit({"type": "phase_done", "phase": name, "seconds": time.time() - started})
+
+
+def _resolve_profile_hook(hook):
+    """A hook is a callable (or "module:function" string) taking the phase name and returning a context manager."""
+    if hook is None or callable(hook):
+        return hook
+    module_name, _, attr = hook.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+@contextmanager
+def _profiled(profiler, name):
+    """Wraps one phase with cProfile and tracemalloc, plus CPU time of the pg_dump/psql children it ran."""
+    hook = profiler["hook"](name) if profiler["hook"] else nullcontext()
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(10)
+    else:
+        tracemalloc.reset_peak()
+
+    times_before = os.times()
+    thread_cpu_before = time.thread_time()
+    wall_before = time.time()
+    prof = cProfile.Profile()
+    try:
+        with hook:
+            prof.enable()
+            try:
+                yield
+            finally:
+                prof.disable()
+    finally:
+        times_after = os.times()
+        _, peak = tracemalloc.get_traced_memory()
+        allocations = tracemalloc.take_snapshot().statistics("lineno")[:PROFILE_TOP_N]
+        if started_tracing:
+            tracemalloc.stop()
+
+        profiler["phases"].append(
+            {
+                "phase": name,
+                "profile": prof,
+                "allocations": allocations,
+                "wall_seconds": time.time() - wall_before,
+                "python_cpu_seconds": time.thread_time() - thread_cpu_before,
+                # Children are only accounted once reaped; Windows always reports 0 here.
+                "child_cpu_seconds": (times_after.children_user - times_before.children_user)
+                + (times_after.children_system - times_before.children_system),
+                "peak_memory_bytes": peak,
+            }
+        )
+
+
+def write_profile_report(profiler, output_dir):
+    """Writes one .prof file per phase plus a top-N summary of hot functions and allocations."""
+    os.makedirs(output_dir, exist_ok=True)
+    summary = []
+    totals = []
+
+    for index, entry in enumerate(profiler["phases"], start=1):
+        prof_file = os.path.join(output_dir, f"{index:02d}_{entry['phase']}.prof")
+        entry["profile"].dump_stats(prof_file)
+
+        summary.append(f"=== {entry['phase']} ===")
+        summary.append(f"wall: {entry['wall_seconds']:.2f}s")
+        summary.append(f"python cpu: {entry['python_cpu_seconds']:.2f}s")
+        summary.append(f"child cpu (pg_dump/psql): {entry['child_cpu_seconds']:.2f}s")
+        summary.append(f"peak traced memory: {format_bytes(entry['peak_memory_bytes'])}")
+
+        stream = io.StringIO()
+        pstats.Stats(entry["profile"], stream=stream).sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+        summary.append(stream.getvalue().strip())
+
+        summary.append(f"Largest live allocations (top {PROFILE_TOP_N}):")
+        summary.extend(f"   {stat}" for stat in entry["allocations"])
+        summary.append("")
+
+        totals.append({key: value for key, value in entry.items() if key not in ("profile", "allocations")})
+
+    summary.append("=== child processes ===")
+    summary.extend(f"   {p['command']}: {p['cpu_seconds']:.2f}s cpu" for p in profiler["processes"])
+
+    with open(os.path.join(output_dir, "summary.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(summary))
+    with open(os.path.join(output_dir, "profile.json"), "w") as f:
+        json.dump({"phases": totals, "processes": profiler["processes"]}, f, indent=4)
+
+    log(f"\n🔬 Profile written to {output_dir}")
+    for entry in totals:
+        log(
+            f"   {entry['phase']:<12} wall {entry['wall_seconds']:.1f}s | "
+            f"python {entry['python_cpu_seconds']:.1f}s | children {entry['child_cpu_seconds']:.1f}s"
+        )
+
+
+def _run_process(
+    command, env, timeout=None, input=None, stdout=subprocess.PIPE, cancellable=True, progress_file=None
+):
+    """Runs a child process, killing it on timeout or cancellation. Returns (returncode, stdout, stderr).
+
+    With a progress_file, the size of the file the process writes to is reported as progress.
+    """
+    run = _current_run.get() if cancellable else None
+    deadline = time.time() + timeout if timeout else None
+    proc = subprocess.Popen(
+        command,
+        stdin=subprocess.PIPE if input is not None else None,
+        stdout=stdout,
+        stderr=subprocess.PIPE,
+        env=env,
+        text=True,
+        errors="replace",
+    )
+    if run:
+        run.processes.add(proc)
+    times_before = os.times()
+    try:
+        while True:
+            try:
+                out, err = proc.communicate(input, timeout=0.5)
+                break
+            except subprocess.TimeoutExpired:
+                input = None  # Already handed to communicate(); retries must not resend it
+                if progress_file and os.path.exists(progress_file):
+                    progress(os.path.getsize(progress_file))
+                if run and run.cancelled.is_set():
+                    proc.kill()
+                    proc.communicate()
+                    raise BackupCancelled()
+                if deadline and time.time() > deadline:
+                    proc.kill()
+                    proc.communicate()
+                    raise subprocess.TimeoutExpired(command, timeout)
+    finally:
+        if run:
+            run.processes.discard(proc)
+        profiler = _current_profiler.get()
+        if profiler is not None:
+            times_after = os.times()
+            profiler["processes"].append(
+                {
+                    "command": os.path.basename(command[0]),
+                    "cpu_seconds": (times_after.children_user - times_before.children_user)
+                    + (times_after.children_system - times_before.children_system),
+                }
+            )
+    if run and run.cancelled.is_set():
+        raise BackupCancelled()
+    return proc.returncode, out, err
+
+
+@contextmanager
+def _piped_process(command, env, timeout=None):
+    """Starts a child process whose stdout is consumed as a stream. Yields (process, stderr file).
+
+    The process is killed if the run is cancelled, the caller stops reading early or the timeout
+    expires. A timer does the killing, so a process that stalls mid-stream cannot block the reader
+    forever; the timeout then surfaces as subprocess.TimeoutExpired.
+    """
+    run = _current_run.get()
+    timed_out = threading.Event()
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr, env=env)
+        if run:
+            run.processes.add(proc)
+
+        def expire():
+            timed_out.set()
+            proc.kill()
+
+        timer = threading.Timer(timeout, expire) if timeout else None
+        if timer:
+            timer.daemon = True
+            timer.start()
+        try:
+            yield proc, stderr
+        except Exception:
+            # Reading from the killed process fails first; report why it was killed
+            if timed_out.is_set():
+                raise subprocess.TimeoutExpired(command, timeout) from None
+            raise
+        finally:
+            if timer:
+                timer.cancel()
+            if proc.poll() is None:
+                proc.kill()
+            proc.stdout.close()
+            proc.wait()
+            if run:
+                run.processes.discard(proc)
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(command, timeout)
+
+
+# Schemas included in the data dump.
+DUMP_SCHEMAS = ["public", "cron", "auth"]
+DEFAULT_DUMP_TIMEOUT = 1200
+# Phases of backup_project, in order (for progress displays)
+BACKUP_PHASES = [
+    "plan",
+    "fingerprint",
+    "roles",
+    "schema",
+    "data",
+    "parquet",
+    "metadata",
+    "compress",
+    "replicate",
+    "cleanup",
+]
+
+
+def run_command(command, env, log_name, timeout=DEFAULT_DUMP_TIMEOUT, progress_file=None):
+    """Helper to run subprocess commands."""
+    log(f"Generating {log_name}...")
+    try:
+        # Check if the executable exists before running to avoid silent failures
+        exe_name = command[0]
+        if shutil.which(exe_name) is None:
+            log(f"❌ Error: Executable '{exe_name}' not found in PATH.")
+            return False
+
+        returncode, _, stderr = _run_process(
+            command, env, timeout, stdout=subprocess.DEVNULL, progress_file=progress_file
+        )
+        if returncode != 0:
+            log(f"❌ Error generating {log_name}:")
+            log(stderr)
+            return False
+        log(f"✔ {log_name} created.")
+    except subprocess.TimeoutExpired:
+        log(f"❌ Error: {log_name} process timed out.")
+        return False
+    except BackupCancelled:
+        raise
+    except Exception as e:
+        log(f"❌ Unexpected error: {e}")
+        return False
+    return True
+
+
+def run_query(psql, conn_args, env, sql):
+    """Runs a single read-only query through psql and returns its unaligned output (or None on failure)."""
+    if shutil.which(psql) is None:
+        return None
+    try:
+        returncode, stdout, _ = _run_process(
+            [psql] + conn_args + ["-X", "-A", "-t", "-v", "ON_ERROR_STOP=1", "-c", sql], env, timeout=120
+        )
+    except (subprocess.TimeoutExpired, OSError):
+        return None
+    return stdout.strip() if returncode == 0 else None
+
+
+# One catalog walk hashed server-side: returns "<roles_md5>|<schema_md5>".
+# Only definition-level columns are included (no relpages/reltuples etc.), so
+# VACUUM/ANALYZE or plain data changes never invalidate the fingerprint.
+# fetch_fingerprints fills in {authid} and {publication_namespace} where the server allows them.
+FINGERPRINT_QUERY = """
+SELECT
+  (SELECT md5(coalesce(string_agg(r, E'\\n' ORDER BY r), '')) FROM (
+      SELECT concat_ws('|', rolname, rolsuper, rolinherit, rolcreaterole, rolcreatedb, rolcanlogin,
+                       rolreplication, rolbypassrls, rolconnlimit, rolvaliduntil, rolconfig::text) AS r
+        FROM pg_catalog.pg_roles
+      UNION ALL
+      SELECT concat_ws('|', roleid::regrole, member::regrole, admin_option) FROM pg_catalog.pg_auth_members
+      UNION ALL
+      SELECT concat_ws('|', 'rs', rs::text) FROM pg_catalog.pg_db_role_setting rs
+      UNION ALL
+      SELECT concat_ws('|', 'rc', objoid::regrole, description) FROM pg_catalog.pg_shdescription
+       WHERE classoid = 'pg_catalog.pg_authid'::regclass
+      UNION ALL
+      SELECT concat_ws('|', 'rl', sl::text) FROM pg_catalog.pg_shseclabel sl
+{authid}  ) AS roles),
+  (SELECT md5(coalesce(string_agg(s, E'\\n' ORDER BY s), '')) FROM (
+      SELECT concat_ws('|', 'n', nspname, nspowner::regrole, nspacl::text) AS s FROM pg_catalog.pg_namespace
+       WHERE nspname !~ '^pg_(toast_)?temp_'
+      UNION ALL
+      SELECT concat_ws('|', 'c', relnamespace::regnamespace, relname, relkind, relowner::regrole, relacl::text,
+                       reloptions::text, relrowsecurity, relforcerowsecurity, relpersistence, relispartition,
+                       relreplident, pg_get_expr(relpartbound, oid))
+        FROM pg_catalog.pg_class WHERE relpersistence <> 't'
+      UNION ALL
+      SELECT concat_ws('|', 'h', inhrelid::regclass, inhparent::regclass, inhseqno) FROM pg_catalog.pg_inherits
+      UNION ALL
+      -- Whole rows (collation, storage, statistics target, compression, options, ...) except the fast
+      -- ADD COLUMN default, which a table rewrite moves into the table
+      SELECT concat_ws('|', 'a', a.attrelid::regclass, (to_jsonb(a) - 'atthasmissing' - 'attmissingval')::text)
+        FROM pg_catalog.pg_attribute a JOIN pg_catalog.pg_class c ON c.oid = a.attrelid
+       WHERE a.attnum > 0 AND c.relpersistence <> 't'
+      UNION ALL
+      SELECT concat_ws('|', 'd', adrelid::regclass, adnum, pg_get_expr(adbin, adrelid)) FROM pg_catalog.pg_attrdef
+      UNION ALL
+      SELECT concat_ws('|', 'k', conrelid::regclass, contypid::regtype, conname, pg_get_constraintdef(oid))
+        FROM pg_catalog.pg_constraint
+      UNION ALL
+      SELECT concat_ws('|', 'i', indexrelid::regclass, pg_get_indexdef(indexrelid), indisclustered, indisreplident)
+        FROM pg_catalog.pg_index
+      UNION ALL
+      SELECT concat_ws('|', 'f', p.pronamespace::regnamespace, p.proname, p.proargtypes::text,
+                       p.prorettype::regtype, p.prokind, p.provolatile, p.prosecdef, p.proconfig::text,
+                       p.proowner::regrole, p.proacl::text, p.proisstrict, p.proparallel, p.procost, p.prorows,
+                       p.proleakproof, p.proretset, l.lanname, pg_get_function_arguments(p.oid),
+                       md5(coalesce(p.prosrc, '')), md5(coalesce(p.probin, '')))
+        FROM pg_catalog.pg_proc p JOIN pg_catalog.pg_language l ON l.oid = p.prolang
+      UNION ALL
+      SELECT concat_ws('|', 't', tgrelid::regclass, tgname, tgenabled, pg_get_triggerdef(oid))
+        FROM pg_catalog.pg_trigger
+      UNION ALL
+      SELECT concat_ws('|', 'r', ev_class::regclass, rulename, md5(pg_get_ruledef(oid))) FROM pg_catalog.pg_rewrite
+      UNION ALL
+      SELECT concat_ws('|', 'p', polrelid::regclass, polname, polcmd, polpermissive, polroles::text,
+                       pg_get_expr(polqual, polrelid), pg_get_expr(polwithcheck, polrelid))
+        FROM pg_catalog.pg_policy
+      UNION ALL
+      SELECT concat_ws('|', 'y', typnamespace::regnamespace, ty::text) FROM pg_catalog.pg_type ty
+       WHERE typnamespace::regnamespace::text !~ '^pg_(toast_)?temp_'
+      UNION ALL
+      SELECT concat_ws('|', 'e', enumtypid::regtype, enumsortorder, enumlabel) FROM pg_catalog.pg_enum
+      UNION ALL
+      SELECT concat_ws('|', 's', seqrelid::regclass, seqtypid::regtype, seqstart, seqincrement, seqmax, seqmin,
+                       seqcache, seqcycle)
+        FROM pg_catalog.pg_sequence
+      UNION ALL
+      SELECT concat_ws('|', 'x', extname, extversion, extnamespace::regnamespace) FROM pg_catalog.pg_extension
+      UNION ALL
+      -- Sequence OWNED BY (and identity sequences) and extension membership
+      SELECT concat_ws('|', 'q', classid::regclass, objid, objsubid, refclassid::regclass, refobjid, refobjsubid,
+                       deptype)
+        FROM pg_catalog.pg_depend
+       WHERE deptype = 'e' OR (classid = 'pg_catalog.pg_class'::regclass AND deptype IN ('a', 'i')
+                               AND objid IN (SELECT seqrelid FROM pg_catalog.pg_sequence))
+      UNION ALL
+      SELECT concat_ws('|', 'g', defaclrole::regrole, defaclnamespace, defaclobjtype, defaclacl::text)
+        FROM pg_catalog.pg_default_acl
+      UNION ALL
+      SELECT concat_ws('|', 'm', classoid::regclass, objoid, objsubid, description) FROM pg_catalog.pg_description
+      UNION ALL
+      -- Whole rows: these catalogs differ between PostgreSQL versions, and every column is definition-level
+      SELECT concat_ws('|', 'u', p::text) FROM pg_catalog.pg_publication p
+      UNION ALL
+      SELECT concat_ws('|', 'ur', pr.prpubid, pr.prrelid::regclass, pr::text) FROM pg_catalog.pg_publication_rel pr
+{publication_namespace}      UNION ALL
+      SELECT concat_ws('|', 'v', e::text) FROM pg_catalog.pg_event_trigger e
+      UNION ALL
+      SELECT concat_ws('|', 'w', w::text) FROM pg_catalog.pg_foreign_data_wrapper w
+      UNION ALL
+      SELECT concat_ws('|', 'fs', fs::text) FROM pg_catalog.pg_foreign_server fs
+      UNION ALL
+      SELECT concat_ws('|', 'ft', ft.ftrelid::regclass, ft::text) FROM pg_catalog.pg_foreign_table ft
+      UNION ALL
+      SELECT concat_ws('|', 'um', um::text) FROM pg_catalog.pg_user_mappings um
+      UNION ALL
+      SELECT concat_ws('|', 'o', co::text) FROM pg_catalog.pg_collation co
+      UNION ALL
+      SELECT concat_ws('|', 'z', ca.castsource::regtype, ca.casttarget::regtype, ca::text) FROM pg_catalog.pg_cast ca
+      UNION ALL
+      SELECT concat_ws('|', 'sx', sx::text) FROM pg_catalog.pg_statistic_ext sx
+      UNION ALL
+      SELECT concat_ws('|', 'ag', ag::text) FROM pg_catalog.pg_aggregate ag
+      UNION ALL
+      SELECT concat_ws('|', 'op', op::text) FROM pg_catalog.pg_operator op
+      UNION ALL
+      SELECT concat_ws('|', 'oc', oc::text) FROM pg_catalog.pg_opclass oc
+      UNION ALL
+      SELECT concat_ws('|', 'of', opf::text) FROM pg_catalog.pg_opfamily opf
+      UNION ALL
+      SELECT concat_ws('|', 'ao', ao::text) FROM pg_catalog.pg_amop ao
+      UNION ALL
+      SELECT concat_ws('|', 'ap', ap::text) FROM pg_catalog.pg_amproc ap
+      UNION ALL
+      SELECT concat_ws('|', 'am', am::text) FROM pg_catalog.pg_am am
+      UNION ALL
+      SELECT concat_ws('|', 'rg', rg::text) FROM pg_catalog.pg_range rg
+      UNION ALL
+      SELECT concat_ws('|', 'cv', cv::text) FROM pg_catalog.pg_conversion cv
+      UNION ALL
+      SELECT concat_ws('|', 'tr', tr::text) FROM pg_catalog.pg_transform tr
+      UNION ALL
+      SELECT concat_ws('|', 'l', la::text) FROM pg_catalog.pg_language la
+      UNION ALL
+      SELECT concat_ws('|', 'tc', tc::text) FROM pg_catalog.pg_ts_config tc
+      UNION ALL
+      SELECT concat_ws('|', 'tm', tm::text) FROM pg_catalog.pg_ts_config_map tm
+      UNION ALL
+      SELECT concat_ws('|', 'td', td::text) FROM pg_catalog.pg_ts_dict td
+      UNION ALL
+      SELECT concat_ws('|', 'tp', tp::text) FROM pg_catalog.pg_ts_parser tp
+      UNION ALL
+      SELECT concat_ws('|', 'tt', tt::text) FROM pg_catalog.pg_ts_template tt
+      UNION ALL
+      SELECT concat_ws('|', 'sl', sl::text) FROM pg_catalog.pg_seclabel sl
+  ) AS catalog);
+"""
+
+
+# Catalogs that only some servers or users can read. Checked first, because reading a table
+# without the privilege (or one that does not exist) fails the whole fingerprint query.
+FINGERPRINT_OPTIONAL_QUERY = """
+SELECT concat_ws('|', has_table_privilege('pg_catalog.pg_authid', 'SELECT'),
+                 to_regclass('pg_catalog.pg_publication_namespace') IS NOT NULL);
+"""
+# pg_roles masks passwords, and pg_authid is only readable by superusers
+FINGERPRINT_AUTHID_ROWS = """      UNION ALL
+      SELECT concat_ws('|', 'pw', rolname, md5(coalesce(rolpassword, ''))) FROM pg_catalog.pg_authid
+"""
+FINGERPRINT_PUBLICATION_NAMESPACE_ROWS = """      UNION ALL
+      SELECT concat_ws('|', 'un', pn::text) FROM pg_catalog.pg_publication_namespace pn
+"""
+
+
+def fetch_fingerprints(psql, conn_args, env):
+    """Hashes roles and schema catalog state. Returns (roles_hash, schema_hash) or (None, None)."""
+    optional = run_query(psql, conn_args, env, FINGERPRINT_OPTIONAL_QUERY)
+    if not optional or optional.count("|") != 1:
+        return None, None
+    authid, publication_namespace = (value == "t" for value in optional.split("|"))
+    query = FINGERPRINT_QUERY.format(
+        authid=FINGERPRINT_AUTHID_ROWS if authid else "",
+        publication_namespace=FINGERPRINT_PUBLICATION_NAMESPACE_ROWS if publication_namespace else "",
+    )
+    output = run_query(psql, conn_args, env, query)
+    if not output or output.count("|") != 1:
+        return None, None
+    roles_hash, schema_hash = output.split("|")
+    return roles_hash or None, schema_hash or None
+
+
+def load_fingerprint_state(cache_dir):
+    state_file = os.path.join(cache_dir, "state.json")
+    try:
+        with open(state_file, "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def save_fingerprint_state(cache_dir, state):
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, "state.json"), "w") as f:
+        json.dump(state, f, indent=4)
+
+
+def restore_cached_dump(cache_dir, state, kind, fingerprint, dest_file, password=None):
+    """Copies a previously dumped file into place when its catalog fingerprint still matches."""
+    entry = state.get(kind)
+
+    # Caches from before encryption were plain .sql files: delete them and dump afresh
+    if entry and not entry["file"].endswith(".zip"):
+        try:
+            os.remove(os.path.join(cache_dir, entry["file"]))
+        except OSError:
+            pass
+        del state[kind]
+        return False
+
+    if not fingerprint or not entry or entry.get("hash") != fingerprint:
+        return False
+
+    # Periodic forced refresh, so a blind spot in the fingerprint can never persist forever.
+    if config.FULL_REFRESH_DAYS > 0 and time.time() - entry.get("dumped_at", 0) > config.FULL_REFRESH_DAYS * 86400:
+        return False
+
+    cached_file = os.path.join(cache_dir, entry["file"])
+    if not os.path.exists(cached_file):
+        return False
+
+    try:
+        with pyzipper.AESZipFile(cached_file) as zf:
+            if password:
+                zf.setpassword(password.encode("utf-8"))
+            with zf.open(f"{kind}.sql") as src, open(dest_file, "wb") as out:
+                shutil.copyfileobj(src, out)
+    except (RuntimeError, KeyError, OSError, pyzipper.BadZipFile) as e:
+        # Wrong/changed ZIP_PASSWORD or a damaged cache: fall back to a fresh dump
+        log(f"⚠️ Cached {kind}.sql unreadable ({e}). Running a full dump.")
+        if os.path.exists(dest_file):
+            os.remove(dest_file)
+        return False
+    log(f"✔ {kind}.sql unchanged (fingerprint {fingerprint[:12]}), reused cached dump.")
+    return True
+
+
+def store_cached_dump(cache_dir, state, kind, fingerprint, source_file, password=None):
+    """Keeps a single copy of the latest dump per kind, referenced by its fingerprint.
+
+    The copy is AES-encrypted with the project's ZIP_PASSWORD, like the archives it ends up in.
+    """
+    if not fingerprint:
+        return
+
+    os.makedirs(cache_dir, exist_ok=True)
+    filename = f"{kind}-{fingerprint}.zip"
+    with pyzipper.AESZipFile(
+        os.path.join(cache_dir, filename), "w", compression=pyzipper.ZIP_LZMA, encryption=pyzipper.WZ_AES
+    ) as zf:
+        if password:
+            zf.setpassword(password.encode("utf-8"))
+            zf.setencryption(pyzipper.WZ_AES, nbits=256)
+        zf.write(source_file, f"{kind}.sql")
+
+    previous = state.get(kind)
+    if previous and previous.get("file") != filename:
+        try:
+            os.remove(os.path.join(cache_dir, previous["file"]))
+        except OSError:
+            pass
+
+    state[kind] = {"hash": fingerprint, "file": filename, "dumped_at": time.time()}
+
+
+PLAN_QUERY = """
+SELECT '*', pg_database_size(current_database()), 0
+UNION ALL
+SELECT n.nspname || '.' || c.relname, pg_table_size(c.oid), greatest(c.reltuples, 0)::bigint
+  FROM pg_catalog.pg_class c JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+ WHERE c.relkind IN ('r', 'p') AND n.nspname IN ({schemas});
+"""
+
+# Fallback ratios/throughputs used until a project has run history of its own.
+DEFAULT_DUMP_RATIO = 1.0  # data.sql bytes per byte of on-disk table storage
+DEFAULT_ARCHIVE_RATIO = 0.25  # archive bytes per byte of raw dump
+DEFAULT_DUMP_BPS = 10 * 1024 * 1024
+DEFAULT_COMPRESS_BPS = 5 * 1024 * 1024
+HISTORY_LIMIT = 50
+
+
+def format_bytes(num):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(num) < 1024:
+            return f"{num:.1f} {unit}"
+        num /= 1024
+    return f"{num:.1f} TB"
+
+
+def load_run_history(history_dir, project_prefix):
+    history_file = os.path.join(history_dir, f"{project_prefix or 'default'}.json")
+    try:
+        with open(history_file, "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return []
+
+
+def save_run_history(history_dir, project_prefix, history):
+    os.makedirs(history_dir, exist_ok=True)
+    history_file = os.path.join(history_dir, f"{project_prefix or 'default'}.json")
+    with open(history_file, "w") as f:
+        json.dump(history[-HISTORY_LIMIT:], f, indent=4)
+
+
+def _historical(history, numerator, denominator, default):
+    """Median of numerator/denominator across past runs that recorded both."""
+    samples = [run[numerator] / run[denominator] for run in history if run.get(numerator) and run.get(denominator)]
+    return statistics.median(samples) if samples else default
+
+
+def filtered_fraction(psql, conn_args, env, table, condition, rows):
+    """The planner's estimate of the share of a table's rows a row filter keeps (1.0 when unknown)."""
+    output = run_query(psql, conn_args, env, f"EXPLAIN (FORMAT JSON) SELECT 1 FROM {table} WHERE {condition}")
+    if not output or not rows:
+        return 1.0
+    try:
+        return min(1.0, json.loads(output)[0]["Plan"]["Plan Rows"] / rows)
+    except (ValueError, LookupError, TypeError):
+        return 1.0
+
+
+def plan_backup(psql, conn_args, env, backups_dir, history, applied_policy=None):
+    """Estimates dump/archive size and duration, checks free space and picks the run strategy.
+
+    With an applied table policy, only the data this run dumps is counted: excluded, schema-only
+    and deferred tables add nothing, and row-filtered tables only the share their filter keeps.
+    """
+    output = run_query(psql, conn_args, env, PLAN_QUERY.format(schemas=", ".join(f"'{s}'" for s in DUMP_SCHEMAS)))
+    if output is None:
+        return None
+
+    db_bytes = 0
+    tables = {}
+    for line in output.splitlines():
+        name, size, rows = line.split("|")
+        if name == "*":
+            db_bytes = int(size)
+        else:
+            tables[name] = {"bytes": int(size), "rows": int(rows)}
+
+    skipped_bytes = 0
+    if applied_policy:
+        no_data = {_unquoted(t) for t in applied_policy["exclude"] + applied_policy["schema_only"]}
+        no_data |= {_unquoted(t) for t in applied_policy["deferred"]}
+        for name in no_data & set(tables):
+            skipped_bytes += tables.pop(name)["bytes"]
+        for table, condition in applied_policy["row_filters"].items():
+            info = tables.get(_unquoted(table))
+            if info:
+                fraction = filtered_fraction(psql, conn_args, env, table, condition, info["rows"])
+                skipped_bytes += info["bytes"] - int(info["bytes"] * fraction)
+                info["bytes"], info["rows"] = int(info["bytes"] * fraction), int(info["rows"] * fraction)
+
+    table_bytes = sum(t["bytes"] for t in tables.values())
+    dump_bytes = int(table_bytes * _historical(history, "dump_bytes", "table_bytes", DEFAULT_DUMP_RATIO))
+    archive_bytes = int(dump_bytes * _historical(history, "archive_bytes", "dump_bytes", DEFAULT_ARCHIVE_RATIO))
+    dump_seconds = dump_bytes / _historical(history, "dump_bytes", "dump_seconds", DEFAULT_DUMP_BPS)
+    compress_seconds = dump_bytes / _historical(history, "dump_bytes", "compress_seconds", DEFAULT_COMPRESS_BPS)
+
+    # Raw folder and archive coexist until compression finishes; keep a 20% margin on top.
+    required_bytes = int((dump_bytes + archive_bytes) * 1.2)
+    free_bytes = shutil.disk_usage(backups_dir).free
+
+    return {
+        "db_bytes": db_bytes,
+        "table_bytes": table_bytes,
+        "skipped_bytes": skipped_bytes,
+        "table_count": len(tables),
+        "row_estimate": sum(t["rows"] for t in tables.values()),
+        "largest_tables": sorted(tables.items(), key=lambda item: item[1]["bytes"], reverse=True)[:5],
+        "dump_bytes": dump_bytes,
+        "archive_bytes": archive_bytes,
+        "dump_seconds": dump_seconds,
+        "compress_seconds": compress_seconds,
+        "required_bytes": required_bytes,
+        "free_bytes": free_bytes,
+        "strategy": {
+            "fits_on_disk": free_bytes >= required_bytes,
+            # Plain-format dumps are staged to disk in one pass, so the only knob is the per-dump timeout.
+            "dump_timeout": max(DEFAULT_DUMP_TIMEOUT, int(dump_seconds * 3)),
+        },
+    }
+
+
+def print_plan(plan):
+    log("\n📋 Backup Plan")
+    log(f"   Database size:      {format_bytes(plan['db_bytes'])}")
+    log(f"   Dumped tables:      {plan['table_count']} ({format_bytes(plan['table_bytes'])})")
+    if plan.get("skipped_bytes"):
+        log(f"   Skipped by policy:  {format_bytes(plan['skipped_bytes'])}")
+    log(f"   Estimated rows:     ~{plan['row_estimate']}")
+    for name, info in plan["largest_tables"]:
+        log(f"      {name}: {format_bytes(info['bytes'])}, ~{info['rows']} rows")
+    log(f"   Est. dump size:     {format_bytes(plan['dump_bytes'])}")
+    log(f"   Est. archive size:  {format_bytes(plan['archive_bytes'])}")
+    log(f"   Est. duration:      {plan['dump_seconds'] + plan['compress_seconds']:.0f}s")
+    log(f"   Free space needed:  {format_bytes(plan['required_bytes'])}")
+    log(f"   Free space:         {format_bytes(plan['free_bytes'])}")
+    log(f"   Dump timeout:       {plan['strategy']['dump_timeout']}s")
+
+
+def record_run(history_dir, project_prefix, history, plan, actual):
+    """Appends the actual run metrics (and the estimate made for it) to the project history."""
+    run = dict(actual, timestamp=time.time())
+    if plan:
+        run["table_bytes"] = plan["table_bytes"]
+        run["estimate"] = {
+            key: plan[key] for key in ("dump_bytes", "archive_bytes", "dump_seconds", "compress_seconds")
+        }
+        log("\n📈 Estimate vs Actual")
+        log(f"   Dump size:     {format_bytes(plan['dump_bytes'])} / {format_bytes(actual['dump_bytes'])}")
+        log(f"   Archive size:  {format_bytes(plan['archive_bytes'])} / {format_bytes(actual['archive_bytes'])}")
+        log(f"   Dump time:     {plan['dump_seconds']:.0f}s / {actual['dump_seconds']:.0f}s")
+        log(f"   Compress time: {plan['compress_seconds']:.0f}s / {actual['compress_seconds']:.0f}s")
+    history.append(run)
+    save_run_history(history_dir, project_prefix, history)
+
+
+def folder_size(folder):
+    total = 0
+    for root, _, files in os.walk(folder):
+        for file in files:
+            total += os.path.getsize(os.path.join(root, file))
+    return total
+
+
+EMPTY_POLICY = {"exclude": [], "schema_only": [], "frequency_days": {}, "row_filters": {}}
+
+# Heavy tables are due slightly early so a nightly schedule with jitter still hits "every 7 days".
+FREQUENCY_SLACK_SECONDS = 3600
+
+
+def load_table_policy(env_dir, env_filename, project_prefix):
+    """Per-project table policy: envs/<env name>.policy.json, falling back to settings.json "policies"."""
+    policy_file = os.path.join(env_dir, os.path.splitext(env_filename)[0] + ".policy.json")
+    policy, source = None, None
+
+    if os.path.exists(policy_file):
+        try:
+            with open(policy_file, "r") as f:
+                policy, source = json.load(f), policy_file
+        except (OSError, json.JSONDecodeError) as e:
+            log(f"⚠️ Could not load {os.path.basename(policy_file)} ({e}). Ignoring table policy.")
+    elif project_prefix in config.POLICIES:
+        policy, source = config.POLICIES[project_prefix], "settings.json"
+
+    if not policy:
+        return dict(EMPTY_POLICY), None
+    return {key: policy.get(key, default) for key, default in EMPTY_POLICY.items()}, source
+
+
+def table_dumped_at(table_state, table):
+    """When a table's data last made it into an archive (older state files store a bare timestamp)."""
+    entry = table_state.get(table, 0)
+    return entry["dumped_at"] if isinstance(entry, dict) else entry
+
+
+def archives_holding_tables(table_state, tables):
+    """Names of the newest archives that hold each of these tables' data."""
+    entries = [table_state.get(table) for table in tables]
+    return {entry["archive"] for entry in entries if isinstance(entry, dict) and entry.get("archive")}
+
+
+def resolve_table_policy(policy, table_state, now):
+    """Decides which tables get their data dumped this run."""
+    deferred = [
+        table
+        for table, days in policy["frequency_days"].items()
+        if now - table_dumped_at(table_state, table) < days * 86400 - FREQUENCY_SLACK_SECONDS
+    ]
+    row_filters = {
+        table: condition
+        for table, condition in policy["row_filters"].items()
+        if table not in deferred and table not in policy["exclude"]
+    }
+    return {
+        "exclude": policy["exclude"],
+        "schema_only": policy["schema_only"],
+        "deferred": deferred,
+        "due": [table for table in policy["frequency_days"] if table not in deferred],
+        "row_filters": row_filters,
+    }
+
+
+def policy_dump_args(applied):
+    """pg_dump switches for the main data dump. Row-filtered tables are dumped separately."""
+    args = [f"--exclude-table={table}" for table in applied["exclude"]]
+    skip_data = applied["schema_only"] + applied["deferred"] + list(applied["row_filters"])
+    return args + [f"--exclude-table-data={table}" for table in skip_data]
+
+
+def load_table_state(history_dir, project_prefix):
+    try:
+        with open(os.path.join(history_dir, f"{project_prefix or 'default'}.tables.json"), "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def save_table_state(history_dir, project_prefix, state):
+    os.makedirs(history_dir, exist_ok=True)
+    with open(os.path.join(history_dir, f"{project_prefix or 'default'}.tables.json"), "w") as f:
+        json.dump(state, f, indent=4)
+
+
+def dump_filtered_tables(psql, conn_args, env, row_filters, output_file, timeout=DEFAULT_DUMP_TIMEOUT):
+    """Streams COPY (SELECT ... WHERE <filter>) for each table into a restorable SQL file."""
+    if not row_filters:
+        return True
+
+    log("Generating filtered_data.sql...")
+    try:
+        with open(output_file, "wb") as out:
+            for table, condition in row_filters.items():
+                # Generated columns cannot be COPY'd back in, so list the writable columns explicitly.
+                columns = run_query(
+                    psql,
+                    conn_args,
+                    env,
+                    "SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) FROM pg_catalog.pg_attribute "
+                    f"WHERE attrelid = '{table.replace(chr(39), chr(39) * 2)}'::regclass "
+                    "AND attnum > 0 AND NOT attisdropped AND attgenerated = ''",
+                )
+                if not columns:
+                    log(f"❌ Error: could not read columns of {table}.")
+                    return False
+
+                out.write(f"\n-- Filtered data for {table}: {condition}\n".encode())
+                out.write(f"COPY {table} ({columns}) FROM stdin;\n".encode())
+                out.flush()
+                copy_sql = f"COPY (SELECT {columns} FROM {table} WHERE {condition}) TO STDOUT"
+                returncode, _, stderr = _run_process(
+                    [psql] + conn_args + ["-X", "-v", "ON_ERROR_STOP=1", "-c", copy_sql], env, timeout, stdout=out
+                )
+                if returncode != 0:
+                    log("❌ Error generating filtered_data.sql:")
+                    log(stderr)
+                    return False
+                out.write(b"\\.\n")
+    except subprocess.TimeoutExpired:
+        log("❌ Error: filtered_data.sql process timed out.")
+        return False
+    except OSError as e:
+        log(f"❌ Unexpected error: {e}")
+        return False
+
+    log("✔ filtered_data.sql created.")
+    return True
+
+
+# COPY schema.table (...) FROM stdin; with optionally quoted identifiers ("My Table").
+COPY_LINE = re.compile(rb'^COPY ((?:"(?:[^"]|"")*"|[^ ."]+)(?:\.(?:"(?:[^"]|"")*"|[^ ."]+))?) .*FROM stdin;\s*$')
+
+
+def copy_table_name(line):
+    """Returns the table of a "COPY ... FROM stdin;" line, or None for any other line."""
+    match = COPY_LINE.match(line) if line.startswith(b"COPY ") else None
+    return match.group(1).decode() if match else None
+
+
+def count_copy_rows(sql_file, counts=None):
+    """Counts rows per table in the COPY blocks of a plain-format dump."""
+    counts = {} if counts is None else counts
+    if not os.path.exists(sql_file):
+        return counts
+
+    table = None
+    with open(sql_file, "rb") as f:
+        for line in f:
+            if table is None:
+                table = copy_table_name(line)
+                if table:
+                    counts.setdefault(table, 0)
+            elif line == b"\\.\n":
+                table = None
+            else:
+                counts[table] += 1
+    return counts
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_checksums(folder):
+    """SHA-256 of every file under the folder, keyed by its relative path ("tables/x.sql")."""
+    checksums = {}
+    for root, _, files in os.walk(folder):
+        for file in files:
+            path = os.path.join(root, file)
+            checksums[os.path.relpath(path, folder).replace(os.sep, "/")] = sha256_file(path)
+    return dict(sorted(checksums.items()))
+
+
+def table_member_name(table, extension=".sql"):
+    """File name for a table's data member: public."User Events" -> public.User_Events-1a2b3c4d.sql
+
+    The readable part is lossy ("a b" and a_b look alike, and Windows/macOS ignore case), so a
+    hash of the exact table name keeps every table's file distinct.
+    """
+    readable = "".join(c if c.isalnum() or c in "._-" else "_" for c in table.replace('"', ""))
+    return f"{readable}-{hashlib.sha256(table.encode()).hexdigest()[:8]}{extension}"
+
+
+def _create_member_file(path, table):
+    """Opens a new member file, refusing to overwrite the file of another table."""
+    try:
+        return open(path, "xb")
+    except FileExistsError:
+        raise BackupError(f"{table} maps to {os.path.basename(path)}, which another table already uses.") from None
+
+
+def split_data_by_table(sql_file, tables_dir, preamble=None):
+    """Moves each COPY block of a plain-format dump into tables/<schema.table>.sql.
+
+    Every table file gets the dump's SET preamble, so it restores on its own. What is
+    left (preamble, sequence values) is rewritten in place. Returns the index entries
+    (member, rows, bytes, sha256) per table, and the preamble for follow-up files.
+    """
+    if not os.path.exists(sql_file):
+        return {}, preamble or []
+
+    os.makedirs(tables_dir, exist_ok=True)
+    preamble = list(preamble or [])
+    collect_preamble = not preamble
+    entries = {}
+    residual_file = sql_file + ".residual"
+    table, out, digest = None, None, None
+
+    with open(sql_file, "rb") as f, open(residual_file, "wb") as residual:
+        for line in f:
+            if table is None:
+                table = copy_table_name(line)
+                if table:
+                    check_cancelled()
+                    collect_preamble = False
+                    member = f"tables/{table_member_name(table)}"
+                    out = _create_member_file(os.path.join(tables_dir, os.path.basename(member)), table)
+                    digest = hashlib.sha256()
+                    entries[table] = {"member": member, "rows": 0}
+                    for chunk in preamble + [b"\n", line]:
+                        out.write(chunk)
+                        digest.update(chunk)
+                    continue
+                if collect_preamble and (line.startswith(b"SET ") or line.startswith(b"SELECT pg_catalog.set_config")):
+                    preamble.append(line)
+                residual.write(line)
+            else:
+                out.write(line)
+                digest.update(line)
+                if line == b"\\.\n":
+                    out.close()
+                    entries[table]["sha256"] = digest.hexdigest()
+                    entries[table]["bytes"] = os.path.getsize(out.name)
+                    table = None
+                else:
+                    entries[table]["rows"] += 1
+
+    if out and not out.closed:
+        out.close()
+    os.replace(residual_file, sql_file)
+    return entries, preamble
+
+
+COLUMNS_QUERY = """
+SELECT format('%I.%I', n.nspname, c.relname), a.attname, format_type(a.atttypid, NULL)
+  FROM pg_catalog.pg_attribute a
+  JOIN pg_catalog.pg_class c ON c.oid = a.attrelid
+  JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+ WHERE c.relkind IN ('r', 'p') AND n.nspname IN ({schemas}) AND a.attnum > 0 AND NOT a.attisdropped
+ ORDER BY 1, a.attnum;
+"""
+
+# Column types whose COPY text form Arrow parses exactly. Everything else (numeric, dates and
+# timestamps, json, arrays, ...) is stored as text, so no value is ever rounded or reinterpreted.
+# Dates stay text because "infinity" and BC dates have no date32 value.
+PARQUET_TYPES = {
+    "smallint": "int16",
+    "integer": "int32",
+    "bigint": "int64",
+    "real": "float32",
+    "double precision": "float64",
+    "boolean": "bool",
+}
+PARQUET_ROW_GROUP_ROWS = 128 * 1024
+PARQUET_ROW_GROUP_BYTES = 64 * 1024 * 1024  # Wide text/JSON rows reach this long before the row limit
+PARQUET_BLOCK_BYTES = 8 * 1024 * 1024
+# Dates and timestamps are written as ISO text whatever the server's or role's DateStyle is
+PARQUET_PGOPTIONS = "-c DateStyle=ISO,YMD"
+
+
+def _unquoted(table):
+    return table.replace('"', "")
+
+
+def fetch_table_columns(psql, conn_args, env, schemas):
+    """Returns {schema.table: [(column, type), ...]} for the dumped schemas."""
+    schema_list = ", ".join(f"'{schema}'" for schema in schemas)
+    output = run_query(psql, conn_args, env, COLUMNS_QUERY.format(schemas=schema_list))
+    if output is None:
+        return None
+
+    columns = {}
+    for line in output.splitlines():
+        table, rest = line.split("|", 1)
+        column, pg_type = rest.rsplit("|", 1)
+        columns.setdefault(table, []).append((column, pg_type))
+    return columns
+
+
+def export_table_parquet(psql, conn_args, env, table, columns, condition, output_file, timeout=DEFAULT_DUMP_TIMEOUT):
+    """Streams one table through COPY ... (FORMAT csv) into a Parquet file, one row group at a time.
+
+    A row group is written every PARQUET_ROW_GROUP_ROWS rows or PARQUET_ROW_GROUP_BYTES of Arrow
+    data, whichever comes first, so memory stays bounded by PARQUET_BLOCK_BYTES of CSV plus one
+    row group however wide the rows are. Returns the row count.
+    """
+    names = [name for name, _ in columns]
+    types = {name: pyarrow.type_for_alias(PARQUET_TYPES.get(pg_type, "string")) for name, pg_type in columns}
+    select = ", ".join('"' + name.replace('"', '""') + '"' for name in names)
+    where = f" WHERE {condition}" if condition else ""
+    copy_sql = f"COPY (SELECT {select} FROM {table}{where}) TO STDOUT (FORMAT csv)"
+
+    read_options = pyarrow.csv.ReadOptions(column_names=names, block_size=PARQUET_BLOCK_BYTES)
+    # Text values may span lines. COPY writes NULL as an empty field and '' as "", so only unquoted empties are null.
+    parse_options = pyarrow.csv.ParseOptions(newlines_in_values=True)
+    convert_options = pyarrow.csv.ConvertOptions(
+        column_types=types,
+        null_values=[""],
+        strings_can_be_null=True,
+        quoted_strings_can_be_null=False,
+        true_values=["t"],
+        false_values=["f"],
+    )
+    schema = pyarrow.schema([(name, types[name]) for name in names])
+    copy_env = dict(env, PGOPTIONS=f"{env.get('PGOPTIONS', '')} {PARQUET_PGOPTIONS}".strip())
+
+    rows = 0
+    command = [psql] + conn_args + ["-X", "-v", "ON_ERROR_STOP=1", "-c", copy_sql]
+    with _piped_process(command, copy_env, timeout) as (proc, stderr):
+        with pyarrow.parquet.ParquetWriter(output_file, schema, compression="zstd", use_dictionary=True) as writer:
+            # An empty result has no CSV block to read at all
+            if proc.stdout.peek(1):
+                reader = pyarrow.csv.open_csv(proc.stdout, read_options, parse_options, convert_options)
+                pending, pending_rows, pending_bytes = [], 0, 0
+                for batch in reader:
+                    check_cancelled()
+                    pending.append(batch)
+                    pending_rows += batch.num_rows
+                    pending_bytes += batch.nbytes
+                    if pending_rows >= PARQUET_ROW_GROUP_ROWS or pending_bytes >= PARQUET_ROW_GROUP_BYTES:
+                        group = pyarrow.Table.from_batches(pending, schema)
+                        writer.write_table(group, row_group_size=PARQUET_ROW_GROUP_ROWS)
+                        rows += group.num_rows
+                        pending, pending_rows, pending_bytes = [], 0, 0
+                        progress(os.path.getsize(output_file))
+                if pending:
+                    group = pyarrow.Table.from_batches(pending, schema)
+                    writer.write_table(group, row_group_size=PARQUET_ROW_GROUP_ROWS)
+                    rows += group.num_rows
+
+        if proc.wait() != 0:
+            stderr.seek(0)
+            raise RuntimeError(stderr.read().decode(errors="replace").strip())
+    check_cancelled()
+    return rows
+
+
+def export_parquet(psql, conn_args, env, tables, row_filters, output_dir, timeout=DEFAULT_DUMP_TIMEOUT):
+    """Exports every dumped table to parquet/<schema.table>.parquet. Returns {table: {"member", "rows"}}.
+
+    Tables that fail are logged and skipped; the SQL dump stays the source of truth.
+    """
+    if pyarrow is None:
+        log("⚠️ Parquet export skipped: pyarrow is not installed (pip install pyarrow).")
+        return {}
+
+    log("Exporting tables to Parquet...")
+    all_columns = fetch_table_columns(psql, conn_args, env, DUMP_SCHEMAS)
+    if all_columns is None:
+        log("❌ Error: could not read table columns. Parquet export skipped.")
+        return {}
+    all_columns = {_unquoted(table): columns for table, columns in all_columns.items()}
+    filters = {_unquoted(table): condition for table, condition in row_filters.items()}
+
+    os.makedirs(output_dir, exist_ok=True)
+    index = {}
+    for table in tables:
+        columns = all_columns.get(_unquoted(table))
+        if not columns:
+            log(f"   ⚠️ {table}: columns not found, skipped.")
+            continue
+
+        member = "parquet/" + table_member_name(table, ".parquet")
+        output_file = os.path.join(output_dir, os.path.basename(member))
+        _create_member_file(output_file, table).close()
+        started = time.time()
+        try:
+            rows = export_table_parquet(
+                psql, conn_args, env, table, columns, filters.get(_unquoted(table)), output_file, timeout
+            )
+        except BackupCancelled:
+            raise
+        except (RuntimeError, OSError, subprocess.TimeoutExpired, pyarrow.ArrowException) as e:
+            check_cancelled()  # A killed COPY surfaces as a read error first
+            log(f"   ❌ {table}: {str(e) or type(e).__name__}")
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            continue
+        index[table] = {"member": member, "rows": rows}
+        log(
+            f"   ✔ {table}: {rows} rows, {format_bytes(os.path.getsize(output_file))} "
+            f"in {time.time() - started:.1f}s"
+        )
+
+    log(f"✔ Parquet export: {len(index)} of {len(tables)} tables.")
+    return index
+
+
+def write_metadata(target_folder, metadata):
+    with open(os.path.join(target_folder, "metadata.json"), "w") as f:
+        json.dump(metadata, f, indent=4)
+
+
+def compress_and_encrypt(source_folder, output_zip, password, table_index=None):
+    """Zips a folder with AES-256 encryption using pyzipper.
+
+    With a table index (per-table layout), an index.json member is written last that maps
+    each schema.table to its member's offset, sizes, row count and checksum.
+
+    The archive is written under a temporary name and renamed once complete, so scrubs, drills
+    and retention (which all look for *_backup_*.zip) never see a half-written archive.
+    """
+    log(f"\n📦 Compressing and Encrypting to {output_zip}...")
+    temp_zip = os.path.join(os.path.dirname(output_zip), f".{os.path.basename(output_zip)}.tmp")
+
+    try:
+        with pyzipper.AESZipFile(temp_zip, "w", compression=pyzipper.ZIP_LZMA, encryption=pyzipper.WZ_AES) as zf:
+            if password:
+                zf.setpassword(password.encode("utf-8"))
+                zf.setencryption(pyzipper.WZ_AES, nbits=256)
+
+            written = 0
+            for root, _, files in os.walk(source_folder):
+                for file in files:
+                    check_cancelled()
+                    file_path = os.path.join(root, file)
+                    arcname = os.path.relpath(file_path, os.path.dirname(source_folder))
+                    # Parquet is already compressed; LZMA would only burn CPU on it
+                    compress_type = pyzipper.ZIP_STORED if file.endswith(".parquet") else None
+                    zf.write(file_path, arcname, compress_type=compress_type)
+                    written += os.path.getsize(file_path)
+                    progress(written)
+
+            if table_index:
+                folder = os.path.basename(source_folder)
+                index = {}
+                for table, entry in table_index.items():
+                    info = zf.getinfo(f"{folder}/{entry['member']}")
+                    index[table] = dict(
+                        entry,
+                        offset=info.header_offset,
+                        compressed_size=info.compress_size,
+                        size=info.file_size,
+                    )
+                zf.writestr(f"{folder}/index.json", json.dumps({"version": 1, "tables": index}, indent=4))
+
+        with open(temp_zip, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(temp_zip, output_zip)
+        log("✔ Secured Archive Created.")
+        return True
+    except BackupCancelled:
+        raise
+    except Exception as e:
+        log(f"❌ Error during compression: {e}")
+        return False
+    finally:
+        if os.path.exists(temp_zip):
+            os.remove(temp_zip)
+
+
+def remove_profile_dir(archive_path):
+    """Profiles from --profile runs live next to their archive and go with it."""
+    shutil.rmtree(os.path.splitext(archive_path)[0] + "_profile", ignore_errors=True)
+
+
+def cleanup_backups(
+    backup_dir, project_prefix, scrub_cache=None, max_backups=None, retention_days=None, label=None, keep=()
+):
+    """Retention policy logic. Limits default to settings.json; destinations may override them.
+
+    Archives named in `keep` (the only copy of a lower-frequency table's data) are never deleted.
+    """
+    max_backups = config.MAX_BACKUPS_PER_PROJECT if max_backups is None else max_backups
+    retention_days = config.RETENTION_DAYS if retention_days is None else retention_days
+    log(f"\n🧹 Running Retention Cleanup{f' ({label})' if label else ''}...")
+
+    search_pattern = os.path.join(backup_dir, f"{project_prefix}_backup_*.zip")
+    files = glob.glob(search_pattern)
+
+    # Filter out Permanent backups
+    deletable_files = [f for f in files if "_P.zip" not in f]
+
+    # Filter out the newest archive of each lower-frequency table, until a newer one holds its data
+    for file_path in [f for f in deletable_files if os.path.basename(f) in keep]:
+        log(f"   📌 Kept (newest copy of a lower-frequency table): {os.path.basename(file_path)}")
+        deletable_files.remove(file_path)
+
+    # Archives that failed a scrub never count as one of the "last N" good backups.
+    # They are kept for inspection until the age limit removes them.
+    corrupt_files = [f for f in deletable_files if scrub_failed(scrub_cache or {}, f)]
+    for file_path in corrupt_files:
+        log(f"   ⚠️ Not counted (failed scrub): {os.path.basename(file_path)}")
+    deletable_files = [f for f in deletable_files if f not in corrupt_files]
+
+    # Sort by modification time (newest first)
+    deletable_files.sort(key=os.path.getmtime, reverse=True)
+
+    files_deleted = 0
+
+    # Check Count Limit
+    if max_backups > 0:
+        while len(deletable_files) > max_backups:
+            file_to_remove = deletable_files.pop()
+            try:
+                os.remove(file_to_remove)
+                remove_profile_dir(file_to_remove)
+                log(f"   🗑️ Deleted (Count Limit): {os.path.basename(file_to_remove)}")
+                files_deleted += 1
+            except OSError as e:
+                log(f"   ⚠️ Could not delete {file_to_remove}: {e}")
+
+    # Check Age Limit
+    if retention_days > 0:
+        now = time.time()
+        age_limit_seconds = retention_days * 86400
+
+        for file_path in deletable_files + corrupt_files:
+            file_age = now - os.path.getmtime(file_path)
+            if file_age > age_limit_seconds:
+                try:
+                    os.remove(file_path)
+                    remove_profile_dir(file_path)
+                    log(f"   🗑️ Deleted (Old Age): {os.path.basename(file_path)}")
+                    files_deleted += 1
+                except OSError as e:
+                    log(f"   ⚠️ Could not delete {file_path}: {e}")
+
+    if files_deleted == 0:
+        log("   No cleanup required.")
+
+
+# Linux ioctl that makes a file share another file's extents (btrfs, XFS, ...)
+FICLONE = 0x40049409
+REPLICATE_CHUNK = 4 * 1024 * 1024
+REPLICATE_QUEUE_CHUNKS = 8  # per destination, so a slow disk holds at most 32 MB
+
+
+def _clone_file(source, target):
+    """Reflinks, or failing that hard-links, source to target on the same filesystem.
+
+    Returns "reflink", "hardlink", or None when neither works (a real copy is needed).
+    Archives are never modified after they are written, so a shared inode is safe.
+    """
+    if fcntl is not None:
+        try:
+            with open(source, "rb") as src, open(target, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return "reflink"
+        except OSError:
+            os.remove(target)
+    try:
+        os.link(source, target)
+        return "hardlink"
+    except OSError:
+        return None
+
+
+def _tee_copy(source, targets):
+    """Copies source to every target from a single read. Returns {target: error message or None}.
+
+    One writer thread per target, fed through a bounded queue, so all destinations are written
+    concurrently and a slow one only holds back the reader once its queue is full.
+    """
+    errors = dict.fromkeys(targets)
+    queues = {target: queue.Queue(maxsize=REPLICATE_QUEUE_CHUNKS) for target in targets}
+
+    def writer(target):
+        out = None
+        try:
+            out = open(target, "wb")
+        except OSError as e:
+            errors[target] = str(e)
+        # Keeps draining after an error, so a failed destination never blocks the others
+        for chunk in iter(queues[target].get, None):
+            if errors[target] is None:
+                try:
+                    out.write(chunk)
+                except OSError as e:
+                    errors[target] = str(e)
+        if out:
+            try:
+                out.flush()
+                os.fsync(out.fileno())
+            except OSError as e:
+                errors[target] = errors[target] or str(e)
+            finally:
+                out.close()
+
+    with ThreadPoolExecutor(max_workers=len(targets)) as pool:
+        for target in targets:
+            pool.submit(writer, target)
+        try:
+            with open(source, "rb") as src:
+                for chunk in iter(lambda: src.read(REPLICATE_CHUNK), b""):
+                    check_cancelled()
+                    for target_queue in queues.values():
+                        target_queue.put(chunk)
+        finally:
+            for target_queue in queues.values():
+                target_queue.put(None)
+    return errors
+
+
+def replicate_archive(archive, destinations):
+    """Writes the archive into every destination folder. Returns {destination: {"ok", "method"/"error"}}.
+
+    Each copy goes to a temporary name first and is renamed into place, so a destination
+    never holds a partial archive under its real name.
+    """
+    name = os.path.basename(archive)
+    log(f"\n📤 Replicating {name} to {len(destinations)} destination(s)...")
+    started = time.time()
+    results = {}
+    copies = {}  # temporary file -> (destination, final path) for destinations on other filesystems
+    source_device = os.stat(archive).st_dev
+
+    for destination in destinations:
+        temp_file = os.path.join(destination, f".{name}.tmp")
+        final_file = os.path.join(destination, name)
+        try:
+            os.makedirs(destination, exist_ok=True)
+            if os.path.exists(temp_file):
+                os.remove(temp_file)  # Left over from an interrupted run
+            method = _clone_file(archive, temp_file) if os.stat(destination).st_dev == source_device else None
+            if method:
+                os.replace(temp_file, final_file)
+                results[destination] = {"ok": True, "method": method}
+            else:
+                copies[temp_file] = (destination, final_file)
+        except OSError as e:
+            results[destination] = {"ok": False, "error": str(e)}
+
+    if copies:
+        try:
+            errors = _tee_copy(archive, list(copies))
+        except BackupCancelled:
+            for temp_file in copies:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+            raise
+        for temp_file, (destination, final_file) in copies.items():
+            try:
+                if errors[temp_file]:
+                    raise OSError(errors[temp_file])
+                os.replace(temp_file, final_file)
+                results[destination] = {"ok": True, "method": "copy"}
+            except OSError as e:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+                results[destination] = {"ok": False, "error": str(e)}
+
+    seconds = time.time() - started
+    results = {destination: results[destination] for destination in destinations}
+    for destination, result in results.items():
+        if result["ok"]:
+            log(f"   ✔ {destination} ({result['method']})")
+        else:
+            log(f"   ❌ {destination}: {result['error']}")
+    if copies and seconds:
+        log(f"   Copied {format_bytes(os.path.getsize(archive))} in {seconds:.1f}s")
+    return results
+
+
+SCRUB_JOBS = min(4, os.cpu_count() or 1)
+SCRUB_READ_CHUNK = 1024 * 1024
+
+
+def load_scrub_cache(history_dir, project_prefix):
+    """Last scrub result per archive path, with the size/mtime it was checked at."""
+    cache_file = os.path.join(history_dir, f"{project_prefix or 'default'}.scrub.json")
+    try:
+        with open(cache_file, "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def save_scrub_cache(history_dir, project_prefix, cache):
+    os.makedirs(history_dir, exist_ok=True)
+    cache_file = os.path.join(history_dir, f"{project_prefix or 'default'}.scrub.json")
+    with open(cache_file, "w") as f:
+        json.dump(cache, f, indent=4)
+
+
+def scrub_entry(cache, archive):
+    """The cached result for an archive, or None if it was never checked or changed since."""
+    entry = cache.get(os.path.abspath(archive))
+    try:
+        stat = os.stat(archive)
+    except OSError:
+        return None
+    if not entry or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+        return None
+    return entry
+
+
+def scrub_failed(cache, archive):
+    entry = scrub_entry(cache, archive)
+    return bool(entry) and not entry["ok"]
+
+
+def verify_archive(archive, password, rate_bps=0):
+    """Reads every member of an archive back. Runs in a scrub worker process.
+
+    pyzipper checks each member's CRC (and AES MAC) once it is read to the end. Members listed
+    in metadata.json are also compared against their recorded SHA-256. rate_bps caps how fast
+    this worker reads from disk (0 = unlimited).
+    """
+    started = time.time()
+    errors = []
+    digests = {}
+    disk_bytes = 0
+    try:
+        with pyzipper.AESZipFile(archive) as zf:
+            if password:
+                zf.setpassword(password.encode("utf-8"))
+
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                # Throttle on bytes read from disk, not on decompressed bytes
+                ratio = info.compress_size / info.file_size if info.file_size else 0
+                digest = hashlib.sha256()
+                try:
+                    with zf.open(info) as src:
+                        for chunk in iter(lambda: src.read(SCRUB_READ_CHUNK), b""):
+                            digest.update(chunk)
+                            disk_bytes += len(chunk) * ratio
+                            ahead = disk_bytes / rate_bps - (time.time() - started) if rate_bps else 0
+                            if ahead > 0:
+                                time.sleep(ahead)
+                except Exception as e:
+                    # Any read failure (bad CRC/MAC, truncated LZMA stream, ...) means the member is lost
+                    errors.append(f"{info.filename}: {e}")
+                    continue
+                digests[info.filename] = digest.hexdigest()
+
+            metadata_member = find_archive_member(zf, "metadata.json")
+            if metadata_member in digests:
+                folder = metadata_member.rsplit("/", 1)[0] + "/" if "/" in metadata_member else ""
+                checksums = json.loads(zf.read(metadata_member)).get("checksums", {})
+                for file, expected in checksums.items():
+                    actual = digests.get(folder + file)
+                    if actual is None and not any(e.startswith(f"{folder}{file}:") for e in errors):
+                        errors.append(f"{folder}{file}: missing from archive")
+                    elif actual is not None and actual != expected:
+                        errors.append(f"{folder}{file}: checksum mismatch")
+    except Exception as e:
+        errors.append(str(e) or type(e).__name__)
+
+    return {
+        "ok": not errors,
+        # Every member rejecting the password points at a wrong ZIP_PASSWORD rather than a damaged file
+        "bad_password": bool(errors) and not digests and all("password" in e.lower() for e in errors),
+        "errors": errors,
+        "members": len(digests),
+        "manifest": bool(digests) and any(name.endswith("metadata.json") for name in digests),
+        "seconds": time.time() - started,
+    }
+
+
+def scrub_archives(backup_dir, history_dir, project_prefix, password, jobs=SCRUB_JOBS, rate_bps=0, rescan=False):
+    """Re-verifies the project's archives in a process pool, skipping those unchanged since their last check."""
+    archives = sorted(glob.glob(os.path.join(backup_dir, f"{project_prefix}_backup_*.zip")), key=os.path.getmtime)
+    cache = load_scrub_cache(history_dir, project_prefix)
+    # Forget archives that no longer exist
+    cache = {path: entry for path, entry in cache.items() if os.path.exists(path)}
+    pending = [a for a in archives if rescan or scrub_entry(cache, a) is None]
+
+    skipped = len(archives) - len(pending)
+    log(f"\n🔍 Scrubbing {len(pending)} of {len(archives)} archives ({skipped} unchanged since last check)")
+    if rate_bps:
+        log(f"   Read limit: {format_bytes(rate_bps)}/s")
+
+    if pending:
+        workers = min(jobs, len(pending))
+        pool = ProcessPoolExecutor(max_workers=workers)
+        try:
+            futures = {}
+            for archive in pending:
+                stat = os.stat(archive)
+                # Each worker gets an equal share of the read limit
+                future = pool.submit(verify_archive, archive, password, rate_bps / workers)
+                futures[future] = (archive, stat)
+
+            remaining = set(futures)
+            while remaining:
+                check_cancelled()
+                done, remaining = wait(remaining, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    archive, stat = futures[future]
+                    result = future.result()
+                    name = os.path.basename(archive)
+                    if result["bad_password"]:
+                        log(f"   ⚠️ {name}: ZIP_PASSWORD does not open this archive. Not checked.")
+                        continue
+                    cache[os.path.abspath(archive)] = dict(
+                        result, size=stat.st_size, mtime=stat.st_mtime, checked_at=time.time()
+                    )
+                    save_scrub_cache(history_dir, project_prefix, cache)
+                    if result["ok"]:
+                        rate = stat.st_size / result["seconds"] if result["seconds"] else 0
+                        manifest = "" if result["manifest"] else ", no manifest"
+                        log(f"   ✔ {name}: {result['members']} members OK ({format_bytes(rate)}/s{manifest})")
+                    else:
+                        log(f"   ❌ {name}: {len(result['errors'])} errors (first: {result['errors'][0]})")
+        finally:
+            # On cancel, archives already being read finish in the background; queued ones never start
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    save_scrub_cache(history_dir, project_prefix, cache)
+    corrupt = [os.path.basename(a) for a in archives if scrub_failed(cache, a)]
+    if corrupt:
+        log(f"\n🚨 {len(corrupt)} corrupt archive(s): {', '.join(corrupt)}")
+        log("   They no longer count towards the retention limit. Take a fresh backup and restore-test it.")
+    else:
+        log("✔ All archives verified.")
+    return {"ok": not corrupt, "checked": len(pending), "skipped": skipped, "corrupt": corrupt}
+
+
+DEFAULT_DRILL_TARGET = "postgresql://postgres@localhost:5432/postgres"
+DRILL_JOBS = min(4, os.cpu_count() or 1)
+# Errors caused by the drill server lacking the project's roles or extensions, not by the archive
+DRILL_ENVIRONMENT_ERRORS = re.compile(
+    r'role "[^"]*" does not exist|extension "[^"]*" (?:is not available|does not exist)'
+    r"|could not open extension control file"
+)
+ROLE_STATEMENT = re.compile(r'^(CREATE|ALTER|DROP) ROLE (?:IF EXISTS )?("(?:[^"]|"")+"|[^ ;]+)')
+
+
+def pick_backup(backup_dir, project_prefix, pick="newest", name=None):
+    """Selects the archive a drill restores: a named file, the newest, or a random one."""
+    if name:
+        path = name if os.path.isabs(name) else os.path.join(backup_dir, name)
+        return path if os.path.exists(path) else None
+
+    archives = glob.glob(os.path.join(backup_dir, f"{project_prefix}_backup_*.zip"))
+    if not archives:
+        return None
+    if pick == "random":
+        return random.choice(archives)
+    return max(archives, key=os.path.getmtime)
+
+
+def run_psql_script(psql, conn_args, env, script=None, sql_file=None, extra_env=None, cancellable=True):
+    """Runs SQL through psql without stopping on errors. Returns (ok, stdout, error_lines)."""
+    command = [psql] + conn_args + ["-X", "-A", "-t", "-q"]
+    command += ["-f", sql_file] if sql_file else ["-f", "-"]
+    try:
+        returncode, stdout, stderr = _run_process(
+            command, dict(env, **(extra_env or {})), input=script, cancellable=cancellable
+        )
+    except OSError as e:
+        return False, "", [str(e)]
+    errors = [line for line in stderr.splitlines() if "ERROR:" in line or "FATAL:" in line]
+    return returncode == 0, stdout, errors
+
+
+def with_database(uri, dbname):
+    return urlunparse(urlparse(uri)._replace(path=f"/{dbname}"))
+
+
+def drill_roles_script(roles_file, existing_roles):
+    """
+    roles.sql without its DROP ROLE statements and without the statements for roles the drill
+    server already has, so the drill creates the project's roles but never changes the server's own.
+    """
+    lines = []
+    with open(roles_file, "r", encoding="utf-8") as f:
+        for line in f:
+            match = ROLE_STATEMENT.match(line)
+            if match and (match.group(1) == "DROP" or match.group(2) in existing_roles):
+                continue
+            lines.append(line)
+    return "".join(lines)
+
+
+def table_restore_order(restore_dir):
+    """Per-table data files in the order pg_dump wrote them (referenced tables before their children)."""
+    index_file = os.path.join(restore_dir, "index.json")
+    if not os.path.exists(index_file):
+        return sorted(glob.glob(os.path.join(restore_dir, "tables", "*.sql")))
+    with open(index_file, "r") as f:
+        entries = list(json.load(f)["tables"].values())
+    # Older indexes have no "order"; their entries are already in dump order
+    entries.sort(key=lambda entry: entry.get("order", 0))
+    files = [os.path.join(restore_dir, *entry["member"].split("/")) for entry in entries]
+    return [file for file in files if os.path.exists(file)]
+
+
+def save_drill(history_dir, project_prefix, result):
+    """Appends a drill result to the project's drill history, so RTO trends can be compared."""
+    drills = load_run_history(history_dir, f"{project_prefix or 'default'}.drills")
+    drills.append(result)
+    save_run_history(history_dir, f"{project_prefix or 'default'}.drills", drills)
+    return drills
+
+
+def restore_drill(
+    psql, backup_dir, history_dir, project_prefix, zip_password, archive, target_uri, keep=False, jobs=DRILL_JOBS
+):
+    """Restores an archive into a throwaway database and measures recovery time per phase."""
+    phases = {}
+    env = os.environ.copy()
+    drill_db = f"drill_{project_prefix or 'backup'}_{datetime.now().strftime('%Y%m%d%H%M%S')}".replace("-", "_")
+    drill_uri = with_database(target_uri, drill_db)
+    extract_dir = tempfile.mkdtemp(prefix=".drill_", dir=backup_dir)
+    result = {
+        "timestamp": time.time(),
+        "archive": os.path.basename(archive),
+        "archive_bytes": os.path.getsize(archive),
+        "ok": False,
+        "status": "failed",
+    }
+
+    log(f"\n🧪 Restore drill: {os.path.basename(archive)} -> {drill_db}")
+
+    try:
+        # 1. Extract
+        started = time.time()
+        try:
+            with pyzipper.AESZipFile(archive) as zf:
+                if zip_password:
+                    zf.setpassword(zip_password.encode("utf-8"))
+                zf.extractall(extract_dir)
+        except (RuntimeError, OSError, pyzipper.BadZipFile) as e:
+            log(f"   ❌ Could not extract archive: {e}")
+            result["errors"] = [str(e)]
+            save_drill(history_dir, project_prefix, result)
+            return result
+        phases["extract"] = time.time() - started
+
+        folders = [os.path.join(extract_dir, d) for d in os.listdir(extract_dir)]
+        restore_dir = next((d for d in folders if os.path.isdir(d)), extract_dir)
+        metadata = {}
+        if os.path.exists(os.path.join(restore_dir, "metadata.json")):
+            with open(os.path.join(restore_dir, "metadata.json"), "r") as f:
+                metadata = json.load(f)
+        result["raw_bytes"] = folder_size(restore_dir)
+
+        # 2. Verify checksums recorded at backup time
+        started = time.time()
+        actual_checksums = file_checksums(restore_dir)
+        checksum_failures = [
+            file for file, digest in metadata.get("checksums", {}).items() if actual_checksums.get(file) != digest
+        ]
+        phases["verify"] = time.time() - started
+        result["checksum_failures"] = checksum_failures
+        if not metadata:
+            log("   ⚠️ No metadata.json in archive. Checksums and row counts cannot be verified.")
+
+        # 3. Create the throwaway database
+        started = time.time()
+        ok, _, errors = run_psql_script(psql, ["--dbname", target_uri], env, f'CREATE DATABASE "{drill_db}";')
+        if errors or not ok:
+            log(f"   ❌ Could not create drill database: {'; '.join(errors)}")
+            result["errors"] = errors
+            save_drill(history_dir, project_prefix, result)
+            return result
+        phases["create"] = time.time() - started
+
+        # 4. Create the project's roles, so the schema's owners and grants resolve
+        roles_file = os.path.join(restore_dir, "roles.sql")
+        environment_errors = []
+        if os.path.exists(roles_file):
+            started = time.time()
+            existing = run_query(psql, ["--dbname", target_uri], env, "SELECT quote_ident(rolname) FROM pg_roles")
+            script = drill_roles_script(roles_file, set((existing or "").splitlines()))
+            _, _, environment_errors = run_psql_script(psql, ["--dbname", target_uri], env, script)
+            phases["roles"] = time.time() - started
+            log(f"   ✔ roles.sql restored in {phases['roles']:.1f}s ({len(environment_errors)} errors)")
+
+        # 5. Restore schema, then data. Durability is irrelevant for a throwaway database.
+        restore_env = {"PGOPTIONS": "-c synchronous_commit=off"}
+        restore_errors = []
+
+        def restore_file(sql_file):
+            return run_psql_script(psql, ["--dbname", drill_uri], env, sql_file=sql_file, extra_env=restore_env)[2]
+
+        # Per-table archives: pg_dump wrote the tables parents-first, and the schema already has the FKs.
+        # With triggers (and so FK checks) off for the session, order no longer matters and the tables
+        # load in parallel, largest first so none starts last. Otherwise they load one by one in dump order.
+        table_files = table_restore_order(restore_dir)
+        parallel_jobs = 1
+        if len(table_files) > 1 and jobs > 1:
+            _, _, errors = run_psql_script(
+                psql, ["--dbname", drill_uri], env, "SET session_replication_role = replica;"
+            )
+            if errors:
+                log("   ⚠️ session_replication_role=replica not allowed. Restoring tables in dump order.")
+            else:
+                parallel_jobs = min(jobs, len(table_files))
+                table_files.sort(key=os.path.getsize, reverse=True)
+
+        table_env = restore_env
+        if parallel_jobs > 1:
+            table_env = {"PGOPTIONS": restore_env["PGOPTIONS"] + " -c session_replication_role=replica"}
+
+        def restore_table(sql_file):
+            return run_psql_script(psql, ["--dbname", drill_uri], env, sql_file=sql_file, extra_env=table_env)[2]
+
+        steps = [("schema", "schema.sql"), ("tables", None), ("data", "data.sql")]
+        for step, file in steps + [("filtered_data", "filtered_data.sql")]:
+            started = time.time()
+            if step == "tables":
+                if not table_files:
+                    continue
+                with ThreadPoolExecutor(max_workers=parallel_jobs) as pool:
+                    futures = [pool.submit(contextvars.copy_context().run, restore_table, f) for f in table_files]
+                    errors = [error for future in futures for error in future.result()]
+                file = f"{len(table_files)} tables ({parallel_jobs} parallel jobs)"
+            else:
+                sql_file = os.path.join(restore_dir, file)
+                if not os.path.exists(sql_file):
+                    continue
+                errors = restore_file(sql_file)
+            phases[step] = time.time() - started
+            restore_errors += errors
+            log(f"   ✔ {file} restored in {phases[step]:.1f}s ({len(errors)} errors)")
+        # Missing roles or extensions are the drill server's shortcoming, so they do not fail the drill
+        environment_errors += [error for error in restore_errors if DRILL_ENVIRONMENT_ERRORS.search(error)]
+        result["errors"] = [error for error in restore_errors if not DRILL_ENVIRONMENT_ERRORS.search(error)]
+        result["environment_errors"] = environment_errors
+
+        # 6. Row counts against the counts recorded at backup time
+        started = time.time()
+        expected = metadata.get("tables", {})
+        script = "".join(f"SELECT '{table}', count(*) FROM {table};\n" for table in expected)
+        _, output, _ = run_psql_script(psql, ["--dbname", drill_uri], env, script)
+        restored = dict(line.split("|", 1) for line in output.splitlines() if "|" in line)
+        row_mismatches = {
+            table: {"expected": rows, "restored": int(restored[table]) if table in restored else None}
+            for table, rows in expected.items()
+            if table not in restored or int(restored[table]) != rows
+        }
+        phases["checks"] = time.time() - started
+        result["row_mismatches"] = row_mismatches
+    finally:
+        shutil.rmtree(extract_dir, ignore_errors=True)
+        if not keep:
+            # Runs even when the drill was cancelled, so no throwaway database is left behind
+            run_psql_script(
+                psql, ["--dbname", target_uri], env, f'DROP DATABASE IF EXISTS "{drill_db}";', cancellable=False
+            )
+
+    restore_seconds = sum(phases.get(p, 0) for p in ("roles", "schema", "tables", "data", "filtered_data"))
+    result["phases"] = phases
+    result["rto_seconds"] = sum(phases.values())
+    result["throughput_bps"] = result["raw_bytes"] / restore_seconds if restore_seconds else None
+    # A drill only passes when it restored without SQL errors (other than missing roles or extensions) and
+    # the archive's metadata.json confirmed the result. Without metadata, there is nothing to compare it against.
+    result["error_count"] = len(result["errors"])
+    if result["checksum_failures"] or result["row_mismatches"] or result["errors"]:
+        result["status"] = "failed"
+    elif not metadata:
+        result["status"] = "unverified"
+    else:
+        result["status"] = "passed"
+    result["ok"] = result["status"] == "passed"
+
+    log("\n⏱️ Recovery Time")
+    for phase, seconds in phases.items():
+        log(f"   {phase:<14} {seconds:.1f}s")
+    log(f"   {'total (RTO)':<14} {result['rto_seconds']:.1f}s")
+    if result["throughput_bps"]:
+        log(f"   Restore throughput: {format_bytes(result['throughput_bps'])}/s")
+    for file in result["checksum_failures"]:
+        log(f"   ❌ Checksum mismatch: {file}")
+    for table, counts in result["row_mismatches"].items():
+        log(f"   ❌ Row count mismatch in {table}: expected {counts['expected']}, restored {counts['restored']}")
+    if result["environment_errors"]:
+        log(
+            f"   ⚠️ {len(result['environment_errors'])} errors from roles or extensions the drill server lacks "
+            f"(first: {result['environment_errors'][0]})"
+        )
+    if result["errors"]:
+        log(f"   ❌ {len(result['errors'])} SQL errors during restore (first: {result['errors'][0]})")
+
+    drills = save_drill(history_dir, project_prefix, result)
+    trend = [f"{d['rto_seconds']:.0f}s" for d in drills[-5:] if d.get("rto_seconds") is not None]
+    log(f"   RTO trend (last {len(trend)}): {' -> '.join(trend)}")
+    if result["status"] == "unverified":
+        log("⚠️ Drill unverified: the archive has no metadata.json to check the restore against.")
+    else:
+        log("✔ Drill passed." if result["ok"] else "❌ Drill failed.")
+    return result
+
+
+DEFAULT_OPTIONS = {
+    "permanent": False,
+    "force_full": False,
+    # Drill options
+    "pick": "newest",
+    "backup": None,
+    "target_uri": None,
+    "keep": False,
+    "jobs": DRILL_JOBS,
+    # Profiling: cProfile + tracemalloc per phase, and an optional sampling profiler hook
+    "profile": False,
+    "profile_hook": None,
+    # "single" (data.sql) or "per_table" (tables/<schema.table>.sql + index.json). None = settings.json
+    "layout": None,
+    # Also export every dumped table to Parquet (needs pyarrow). None = settings.json
+    "parquet": None,
+    # Extract options
+    "table": None,
+    "output": None,
+    # Scrub options: read limit in MB/s (None = settings.json) and re-checking unchanged archives
+    "rate_limit": None,
+    "rescan": False,
+}
+
+
+def resolve_project(project):
+    """Accepts an env file name (".production.env") or a project name ("production")."""
+    env_filename = project if project.endswith(".env") else f".{project}.env"
+    env_path = os.path.join(ENV_DIR, env_filename)
+    if not os.path.exists(env_path):
+        raise BackupError(f"Env file {env_filename} not found in {ENV_DIR}.")
+
+    # --- PREFIX LOGIC ---
+    project_prefix = env_filename.replace(".env", "")
+    if project_prefix.startswith("."):
+        project_prefix = project_prefix[1:]
+    return env_filename, env_path, project_prefix
+
+
+def load_credentials(env_path):
+    """Reads the project's .env without touching os.environ, so concurrent runs stay isolated."""
+    values = dotenv_values(env_path)
+    # Like load_dotenv(): variables already set in the process environment take precedence.
+    keys = ["SUPABASE_DB_URI", "SUPABASE_URL", "DB_PASSWORD", "ZIP_PASSWORD", "DRILL_DB_URI"]
+    return {key: os.environ.get(key) or values.get(key) for key in keys}
+
+
+def connection_args(credentials, env_filename):
+    """Returns (pg_dumpall args, pg_dump/psql args, subprocess env) for the project's database."""
+    env = os.environ.copy()
+
+    if credentials["SUPABASE_DB_URI"]:
+        log(f"Connecting using URI from {env_filename}...")
+        common_args = ["--dbname", credentials["SUPABASE_DB_URI"], "--no-password"]
+        return common_args, common_args, env
+
+    log(f"Connecting using URL/Pass from {env_filename}...")
+    if not credentials["SUPABASE_URL"] or not credentials["DB_PASSWORD"]:
+        raise BackupError("Credentials missing in .env")
+    try:
+        parsed = urlparse(credentials["SUPABASE_URL"])
+        if parsed.hostname is None:
+            raise ValueError("Invalid URL: Hostname not found.")
+
+        host = f"db.{parsed.hostname.split('.')[0]}.supabase.co"
+        # Attempt generic DNS resolve
+        try:
+            socket.gethostbyname(host)
+        except socket.gaierror:
+            pass
+    except Exception as e:
+        raise BackupError(f"Connection Error: {e}") from e
+
+    common_args = ["-h", host, "-p", "5432", "-U", "postgres", "--no-password"]
+    env["PGPASSWORD"] = credentials["DB_PASSWORD"]
+    return common_args, common_args + ["-d", "postgres"], env
+
+
+def plan_project(project, options=None):
+    """Runs only the planning step for a project and returns the plan."""
+    config.load()
+    env_filename, env_path, project_prefix = resolve_project(project)
+    _, s_args, env = connection_args(load_credentials(env_path), env_filename)
+    os.makedirs(BACKUPS_DIR, exist_ok=True)
+
+    policy, _ = load_table_policy(ENV_DIR, env_filename, project_prefix)
+    applied_policy = resolve_table_policy(policy, load_table_state(HISTORY_DIR, project_prefix), time.time())
+    history = load_run_history(HISTORY_DIR, project_prefix)
+    plan = plan_backup(PSQL, s_args, env, BACKUPS_DIR, history, applied_policy)
+    if plan is None:
+        raise BackupError("Could not query database size.")
+    print_plan(plan)
+    return plan
+
+
+def backup_project(project, options=None):
+    """Runs the full backup pipeline for one project. Returns a result dict."""
+    options = dict(DEFAULT_OPTIONS, **(options or {}))
+    config.load()
+    options["layout"] = options["layout"] or config.ARCHIVE_LAYOUT
+    options["parquet"] = config.PARQUET_EXPORT if options["parquet"] is None else options["parquet"]
+    env_filename, env_path, project_prefix = resolve_project(project)
+    credentials = load_credentials(env_path)
+    common_args, s_args, env = connection_args(credentials, env_filename)
+    zip_password = credentials["ZIP_PASSWORD"]
+    os.makedirs(BACKUPS_DIR, exist_ok=True)
+
+    profiler = None
+    if options["profile"]:
+        profiler = {"hook": _resolve_profile_hook(options["profile_hook"]), "phases": [], "processes": []}
+        _current_profiler.set(profiler)
+
+    # 1. Plan: size up the job before anything is written to disk
+    with phase("plan"):
+        # Table policy: exclusions, schema-only tables, lower-frequency tiers and row filters.
+        # Resolved first, so the plan only counts the data this run actually dumps.
+        policy, policy_source = load_table_policy(ENV_DIR, env_filename, project_prefix)
+        table_state = load_table_state(HISTORY_DIR, project_prefix)
+        applied_policy = resolve_table_policy(policy, table_state, time.time())
+        if policy_source:
+            log(f"\n📑 Table policy from {os.path.basename(policy_source)}:")
+            for label, key in [
+                ("Excluded", "exclude"),
+                ("Schema only", "schema_only"),
+                ("Deferred (not due)", "deferred"),
+                ("Heavy tables due", "due"),
+                ("Row filtered", "row_filters"),
+            ]:
+                if applied_policy[key]:
+                    log(f"   {label}: {', '.join(applied_policy[key])}")
+
+        history = load_run_history(HISTORY_DIR, project_prefix)
+        plan = plan_backup(PSQL, s_args, env, BACKUPS_DIR, history, applied_policy)
+
+        if plan is None:
+            log("⚠️ Could not query database size. Skipping pre-run checks.")
+        else:
+            print_plan(plan)
+            if not plan["strategy"]["fits_on_disk"]:
+                raise BackupError("Not enough free space in the backups folder for this run.")
+
+        dump_timeout = plan["strategy"]["dump_timeout"] if plan else DEFAULT_DUMP_TIMEOUT
+
+    # 2. Folder Setup
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    suffix = "_P" if options["permanent"] else ""
+    folder_name = f"{project_prefix}_backup_{timestamp}{suffix}" if project_prefix else f"backup_{timestamp}{suffix}"
+
+    target_folder = os.path.join(BACKUPS_DIR, folder_name)
+    if not os.path.exists(target_folder):
+        os.makedirs(target_folder)
+
+    try:
+        # 3. Execute Dumps
+        roles_file = os.path.join(target_folder, "roles.sql")
+        schema_file = os.path.join(target_folder, "schema.sql")
+        data_file = os.path.join(target_folder, "data.sql")
+        filtered_data_file = os.path.join(target_folder, "filtered_data.sql")
+
+        log("\n--- Starting Backup ---")
+        dump_started = time.time()
+
+        # Fingerprint: one cheap catalog query decides whether roles/schema need a fresh dump
+        with phase("fingerprint"):
+            fingerprint_dir = os.path.join(BACKUPS_DIR, ".fingerprints", project_prefix or "default")
+            fingerprint_state = load_fingerprint_state(fingerprint_dir)
+            roles_hash, schema_hash = (None, None) if options["force_full"] else fetch_fingerprints(PSQL, s_args, env)
+            if options["force_full"]:
+                log("Fingerprinting skipped (--force-full).")
+            elif roles_hash is None:
+                log("⚠️ Catalog fingerprint unavailable. Running full dumps.")
+
+            # Excluded tables change schema.sql, so the policy is part of the schema cache key
+            exclude_args = [f"--exclude-table={table}" for table in applied_policy["exclude"]]
+            if schema_hash and exclude_args:
+                schema_hash = hashlib.md5((schema_hash + json.dumps(sorted(exclude_args))).encode()).hexdigest()
+
+        # Roles
+        with phase("roles"):
+            if not restore_cached_dump(
+                fingerprint_dir, fingerprint_state, "roles", roles_hash, roles_file, zip_password
+            ):
+                if run_command(
+                    [PG_DUMPALL] + common_args + ["--clean", "--if-exists", "--roles-only", "-f", roles_file],
+                    env,
+                    "roles.sql",
+                    dump_timeout,
+                ):
+                    store_cached_dump(fingerprint_dir, fingerprint_state, "roles", roles_hash, roles_file, zip_password)
+
+        # Schema
+        with phase("schema"):
+            if not restore_cached_dump(
+                fingerprint_dir, fingerprint_state, "schema", schema_hash, schema_file, zip_password
+            ):
+                if run_command(
+                    [PG_DUMP] + s_args + exclude_args + ["--schema-only", "-f", schema_file],
+                    env,
+                    "schema.sql",
+                    dump_timeout,
+                ):
+                    store_cached_dump(
+                        fingerprint_dir, fingerprint_state, "schema", schema_hash, schema_file, zip_password
+                    )
+
+            save_fingerprint_state(fingerprint_dir, fingerprint_state)
+
+        # Data
+        with phase("data"):
+            schema_switches = [f"--schema={schema}" for schema in DUMP_SCHEMAS]
+            data_args = ["--data-only"] + schema_switches + policy_dump_args(applied_policy)
+            data_ok = run_command(
+                [PG_DUMP] + s_args + data_args + ["-f", data_file],
+                env,
+                "data.sql",
+                dump_timeout,
+                progress_file=data_file,
+            )
+            filtered_ok = dump_filtered_tables(
+                PSQL, s_args, env, applied_policy["row_filters"], filtered_data_file, dump_timeout
+            )
+            data_ok = data_ok and filtered_ok
+
+            # Lower-frequency tables only count as dumped once the archive holding them exists (see below)
+            dumped_at = time.time() if data_ok else None
+
+            # Per-table layout: one archive member per table, addressable through index.json
+            table_index = None
+            if options["layout"] == "per_table":
+                tables_dir = os.path.join(target_folder, "tables")
+                table_index, preamble = split_data_by_table(data_file, tables_dir)
+                filtered_index, _ = split_data_by_table(filtered_data_file, tables_dir, preamble)
+                table_index.update(filtered_index)
+                # Dump order (parents before children), so restores can respect foreign keys
+                for order, entry in enumerate(table_index.values()):
+                    entry["order"] = order
+                row_counts = {table: entry["rows"] for table, entry in table_index.items()}
+            else:
+                row_counts = count_copy_rows(filtered_data_file, count_copy_rows(data_file))
+
+        # Optional columnar copy of every dumped table, queryable without a restore
+        parquet_index = None
+        if options["parquet"]:
+            with phase("parquet"):
+                parquet_index = export_parquet(
+                    PSQL,
+                    s_args,
+                    env,
+                    list(row_counts),
+                    applied_policy["row_filters"],
+                    os.path.join(target_folder, "parquet"),
+                    dump_timeout,
+                )
+
+        with phase("metadata"):
+            write_metadata(
+                target_folder,
+                {
+                    "project": project_prefix,
+                    "layout": options["layout"],
+                    "created_at": datetime.now().isoformat(timespec="seconds"),
+                    "schemas": DUMP_SCHEMAS,
+                    "fingerprints": {"roles": roles_hash, "schema": schema_hash},
+                    "policy": dict(applied_policy, source=os.path.basename(policy_source) if policy_source else None),
+                    "tables": row_counts,
+                    "parquet": parquet_index,
+                    "checksums": file_checksums(target_folder),
+                },
+            )
+        dump_seconds = time.time() - dump_started
+        dump_bytes = folder_size(target_folder)
+
+        # 4. Compression & Encryption
+        zip_filename = os.path.join(BACKUPS_DIR, f"{folder_name}.zip")
+
+        if not zip_password:
+            log("\n⚠️  WARNING: ZIP_PASSWORD not found. Archive will NOT be encrypted.")
+
+        with phase("compress"):
+            compress_started = time.time()
+            success = compress_and_encrypt(target_folder, zip_filename, zip_password, table_index)
+    except BackupCancelled:
+        log("🛑 Backup cancelled. Removing partial files.")
+        shutil.rmtree(target_folder, ignore_errors=True)
+        if os.path.exists(os.path.join(BACKUPS_DIR, f"{folder_name}.zip")):
+            os.remove(os.path.join(BACKUPS_DIR, f"{folder_name}.zip"))
+        raise
+
+    if success:
+        actual = {
+            "dump_bytes": dump_bytes,
+            "archive_bytes": os.path.getsize(zip_filename),
+            "dump_seconds": dump_seconds,
+            "compress_seconds": time.time() - compress_started,
+        }
+        record_run(HISTORY_DIR, project_prefix, history, plan, actual)
+
+        if dumped_at:
+            archive_name = os.path.basename(zip_filename)
+            for table in applied_policy["due"]:
+                table_state[table] = {"dumped_at": dumped_at, "archive": archive_name}
+            save_table_state(HISTORY_DIR, project_prefix, table_state)
+
+    # 5. Cleanup Raw Folder
+    if success:
+        try:
+            shutil.rmtree(target_folder)
+            log(f"✔ Raw files removed. Backup secured at: {zip_filename}")
+        except OSError as e:
+            log(f"⚠️ Error removing raw folder: {e}")
+    else:
+        log("❌ Encryption failed. Keeping raw folder for safety.")
+
+    # 6. Copy the archive to the extra destinations in settings.json
+    destinations = [d if isinstance(d, dict) else {"path": d} for d in config.DESTINATIONS]
+    replicas = {}
+    if success and destinations:
+        with phase("replicate"):
+            replicas = replicate_archive(zip_filename, [d["path"] for d in destinations])
+
+    # 7. Run Retention Policy, locally and per destination
+    with phase("cleanup"):
+        keep = archives_holding_tables(table_state, policy["frequency_days"])
+        cleanup_backups(BACKUPS_DIR, project_prefix, load_scrub_cache(HISTORY_DIR, project_prefix), keep=keep)
+        for destination in destinations:
+            if os.path.isdir(destination["path"]):
+                cleanup_backups(
+                    destination["path"],
+                    project_prefix,
+                    max_backups=destination.get("max_backups"),
+                    retention_days=destination.get("retention_days"),
+                    label=destination["path"],
+                    keep=keep,
+                )
+
+    if profiler:
+        write_profile_report(profiler, os.path.join(BACKUPS_DIR, f"{folder_name}_profile"))
+
+    replication_ok = all(replica["ok"] for replica in replicas.values())
+    return {
+        "ok": success and replication_ok,
+        "project": project_prefix,
+        "archive": zip_filename if success else None,
+        "replicas": replicas,
+    }
+
+
+def drill_project(project, options=None):
+    """Restores one of the project's archives into a throwaway database. Returns the drill result."""
+    options = dict(DEFAULT_OPTIONS, **(options or {}))
+    config.load()
+    _, env_path, project_prefix = resolve_project(project)
+    credentials = load_credentials(env_path)
+
+    # Drills restore locally and never touch the source database
+    archive = pick_backup(BACKUPS_DIR, project_prefix, options["pick"], options["backup"])
+    if not archive:
+        raise BackupError(f"No backup found to drill for '{project_prefix}'.")
+    target_uri = options["target_uri"] or credentials["DRILL_DB_URI"] or DEFAULT_DRILL_TARGET
+
+    zip_password = credentials["ZIP_PASSWORD"]
+    return restore_drill(
+        PSQL,
+        BACKUPS_DIR,
+        HISTORY_DIR,
+        project_prefix,
+        zip_password,
+        archive,
+        target_uri,
+        options["keep"],
+        options["jobs"],
+    )
+
+
+def find_archive_member(zf, name):
+    return next((member for member in zf.namelist() if member == name or member.endswith(f"/{name}")), None)
+
+
+def extract_table(archive, table, password, output_dir):
+    """Pulls one table out of a per-table archive. Only index.json and that table's member are decrypted."""
+    started = time.time()
+    try:
+        with pyzipper.AESZipFile(archive) as zf:
+            if password:
+                zf.setpassword(password.encode("utf-8"))
+
+            index_member = find_archive_member(zf, "index.json")
+            if not index_member:
+                raise BackupError(f"{os.path.basename(archive)} has no table index (not a per-table archive).")
+            index = json.loads(zf.read(index_member))["tables"]
+
+            wanted = table.replace('"', "")
+            key = next((name for name in index if name.replace('"', "") == wanted), None)
+            if key is None:
+                raise BackupError(f"Table {table} is not in {os.path.basename(archive)}.")
+            entry = index[key]
+
+            os.makedirs(output_dir, exist_ok=True)
+            output_file = os.path.join(output_dir, os.path.basename(entry["member"]))
+            digest = hashlib.sha256()
+            folder = index_member.rsplit("/", 1)[0]
+            with zf.open(f"{folder}/{entry['member']}") as src, open(output_file, "wb") as out:
+                for chunk in iter(lambda: src.read(1024 * 1024), b""):
+                    check_cancelled()
+                    digest.update(chunk)
+                    out.write(chunk)
+    except (RuntimeError, pyzipper.BadZipFile) as e:
+        raise BackupError(f"Could not read {os.path.basename(archive)}: {e}") from e
+
+    if digest.hexdigest() != entry["sha256"]:
+        raise BackupError(f"Checksum mismatch for {key}. The archive may be corrupt.")
+
+    seconds = time.time() - started
+    log(f"✔ {key}: {entry['rows']} rows extracted to {output_file} in {seconds:.1f}s")
+    return {"ok": True, "table": key, "file": output_file, "rows": entry["rows"], "seconds": seconds}
+
+
+def extract_project(project, options=None):
+    """Extracts a single table from one of the project's archives."""
+    options = dict(DEFAULT_OPTIONS, **(options or {}))
+    _, env_path, project_prefix = resolve_project(project)
+    if not options["table"]:
+        raise BackupError("No table given. Use --table schema.table.")
+
+    archive = pick_backup(BACKUPS_DIR, project_prefix, options["pick"], options["backup"])
+    if not archive:
+        raise BackupError(f"No backup found for '{project_prefix}'.")
+    output_dir = options["output"] or os.path.join(BACKUPS_DIR, "extracted")
+    log(f"📤 Extracting {options['table']} from {os.path.basename(archive)}...")
+    return extract_table(archive, options["table"], load_credentials(env_path)["ZIP_PASSWORD"], output_dir)
+
+
+def scrub_project(project, options=None):
+    """Re-verifies all of the project's archives. Returns the scrub summary."""
+    options = dict(DEFAULT_OPTIONS, **(options or {}))
+    config.load()
+    _, env_path, project_prefix = resolve_project(project)
+    rate_limit = config.SCRUB_RATE_LIMIT_MB if options["rate_limit"] is None else options["rate_limit"]
+    return scrub_archives(
+        BACKUPS_DIR,
+        HISTORY_DIR,
+        project_prefix,
+        load_credentials(env_path)["ZIP_PASSWORD"],
+        options["jobs"],
+        rate_limit * 1024 * 1024,
+        options["rescan"],
+    )
+
+
+# --- ASYNC API ---
+
+
+async def _stream(target, project, options):
+    """Runs a pipeline function in a worker thread and yields its events until it finishes."""
+    loop = asyncio.get_running_loop()
+    run = _Run(loop, asyncio.Queue())
+
+    def worker():
+        _current_run.set(run)
+        try:
+            _enter_run(run, bool((options or {}).get("profile")))
+            result = target(project, options)
+            run.emit({"type": "done", "ok": bool(result and result.get("ok", True)), "result": result})
+        except BackupCancelled:
+            run.emit({"type": "done", "ok": False, "cancelled": True, "result": None})
+        except BackupError as e:
+            run.emit({"type": "log", "message": f"❌ Error: {e}"})
+            run.emit({"type": "done", "ok": False, "error": str(e), "result": None})
+        except Exception as e:
+            run.emit({"type": "log", "message": f"CRITICAL ERROR: {e}"})
+            run.emit({"type": "done", "ok": False, "error": str(e), "result": None})
+        finally:
+            _leave_run(run)
+
+    # A fresh context per run, so concurrent runs never see each other's state.
+    future = loop.run_in_executor(None, contextvars.copy_context().run, worker)
+    finished = False
+    try:
+        while True:
+            event = await run.queue.get()
+            yield event
+            if event["type"] == "done":
+                finished = True
+                break
+    finally:
+        # Before "done" only when the caller stopped listening or was cancelled. The generator only
+        # finishes once the worker has stopped, so callers never start a new run next to a dying one.
+        if not finished:
+            run.cancel()
+        await asyncio.shield(future)
+
+
+def run_backup(project, options=None):
+    """Async generator of progress events for a full backup of `project`."""
+    return _stream(backup_project, project, options)
+
+
+def run_plan(project, options=None):
+    """Async generator of progress events for planning a backup of `project`."""
+    return _stream(plan_project, project, options)
+
+
+def run_drill(project, options=None):
+    """Async generator of progress events for a restore drill of `project`."""
+    return _stream(drill_project, project, options)
+
+
+def run_extract(project, options=None):
+    """Async generator of progress events for extracting one table from a per-table archive."""
+    return _stream(extract_project, project, options)
+
+
+def run_scrub(project, options=None):
+    """Async generator of progress events for re-verifying the archives of `project`."""
+    return _stream(scrub_project, project, options)
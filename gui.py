@@ -1,11 +1,19 @@
 import asyncio
 import base64
 import json
+import multiprocessing
 import os
 import sys
+import time
+import uuid
 
 from nicegui import app, ui
 
+import engine
+
+# Scrub workers are separate processes; the frozen exe must hand them off instead of opening another window
+multiprocessing.freeze_support()
+
 # --- CONSTANTS & PATHS ---
 # Detect if running as PyInstaller EXE or normal script
 IS_FROZEN = getattr(sys, "frozen", False)
@@ -24,7 +32,7 @@ os.makedirs(ASSETS_DIR, exist_ok=True)
 app.add_static_files("/assets", ASSETS_DIR)
 
 # --- SETTINGS MANAGEMENT ---
-DEFAULT_SETTINGS = {"max_backups": 5, "retention_days": 30}
+DEFAULT_SETTINGS = {"max_backups": 5, "retention_days": 30, "max_concurrent_jobs": 2}
 
 
 def load_settings():
@@ -157,6 +165,177 @@ def get_env_files():
     return [f for f in os.listdir(ENV_DIR) if f.endswith(".env")]
 
 
+# --- JOB QUEUE ---
+# Jobs live at module level (and in JOBS_FILE), so the queue survives a window reload or an app restart.
+JOBS_FILE = os.path.join(engine.HISTORY_DIR, "gui_jobs.json")
+JOB_LOG_LINES = 500
+JOB_STATUS_COLORS = {
+    "queued": "grey",
+    "running": "primary",
+    "cancelling": "warning",
+    "success": "positive",
+    "failed": "negative",
+    "cancelled": "warning",
+    "interrupted": "warning",
+}
+
+# A cancelled job holds its slot as "cancelling" until its engine worker has actually stopped
+RUNNING_JOB_STATUSES = ("running", "cancelling")
+ACTIVE_JOB_STATUSES = ("queued",) + RUNNING_JOB_STATUSES
+
+job_tasks = {}  # job id -> asyncio.Task of a running job
+
+
+def load_jobs():
+    try:
+        with open(JOBS_FILE, "r") as f:
+            saved = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return []
+    # Jobs that were running when the app closed did not finish
+    for job in saved:
+        if job["status"] in RUNNING_JOB_STATUSES:
+            job["status"] = "interrupted"
+    return saved
+
+
+def save_jobs():
+    os.makedirs(os.path.dirname(JOBS_FILE), exist_ok=True)
+    with open(JOBS_FILE, "w") as f:
+        json.dump(jobs, f, indent=4)
+
+
+jobs = load_jobs()
+
+
+def enqueue_job(project, permanent=False):
+    """Adds a backup to the queue. A project that is already queued or running is not added twice."""
+    if any(job["project"] == project and job["status"] in ACTIVE_JOB_STATUSES for job in jobs):
+        return None
+    job = {"id": uuid.uuid4().hex[:8], "project": project, "permanent": permanent}
+    reset_job(job)
+    jobs.append(job)
+    save_jobs()
+    pump_queue()
+    return job
+
+
+def reset_job(job):
+    job.update(
+        status="queued", phase=None, progress=0, bps=None, log=[], log_count=0, queued_at=time.time(), finished_at=None
+    )
+
+
+def requeue_job(job):
+    if job["status"] in ACTIVE_JOB_STATUSES:
+        return
+    if any(other["project"] == job["project"] and other["status"] in ACTIVE_JOB_STATUSES for other in jobs):
+        return
+    reset_job(job)
+    save_jobs()
+    pump_queue()
+
+
+def cancel_job(job):
+    if job["status"] == "queued":
+        job["status"] = "cancelled"
+        save_jobs()
+    elif job["status"] == "running" and job["id"] in job_tasks:
+        # Cancelling the task closes the engine's event stream, which kills pg_dump and waits for the
+        # run to stop. Until then the job keeps its slot, so no second pg_dump starts next to it.
+        job["status"] = "cancelling"
+        save_jobs()
+        job_tasks[job["id"]].cancel()
+
+
+def clear_finished_jobs():
+    jobs[:] = [job for job in jobs if job["status"] in ACTIVE_JOB_STATUSES]
+    save_jobs()
+
+
+def pump_queue():
+    """Starts queued jobs, oldest first, until max_concurrent_jobs are running."""
+    limit = max(1, int(app_settings.get("max_concurrent_jobs", 2)))
+    running = {job["project"] for job in jobs if job["status"] in RUNNING_JOB_STATUSES}
+    for job in jobs:
+        if len(running) >= limit:
+            break
+        if job["status"] == "queued" and job["project"] not in running:
+            running.add(job["project"])
+            job["status"] = "running"
+            job_tasks[job["id"]] = asyncio.create_task(run_job(job))
+
+
+async def run_job(job):
+    job["started_at"] = time.time()
+    save_jobs()
+    done = {"ok": False}
+    phase_started = time.time()
+    try:
+        async for event in engine.run_backup(job["project"], {"permanent": job["permanent"]}):
+            if event["type"] == "log":
+                lines = event["message"].splitlines()
+                job["log"].extend(lines)
+                job["log_count"] += len(lines)
+                del job["log"][:-JOB_LOG_LINES]
+            elif event["type"] == "phase":
+                job["phase"], job["bps"] = event["phase"], None
+                phase_started = time.time()
+            elif event["type"] == "phase_done" and event["phase"] in engine.BACKUP_PHASES:
+                job["progress"] = (engine.BACKUP_PHASES.index(event["phase"]) + 1) / len(engine.BACKUP_PHASES)
+            elif event["type"] == "progress" and time.time() > phase_started:
+                job["bps"] = event["bytes"] / (time.time() - phase_started)
+            elif event["type"] == "done":
+                done = event
+        job["status"] = "success" if done["ok"] else "failed"
+    except asyncio.CancelledError:
+        job["status"] = "cancelled"
+        job["log"].append("🛑 Cancelled.")
+        job["log_count"] += 1
+    finally:
+        job["finished_at"] = time.time()
+        job_tasks.pop(job["id"], None)
+        save_jobs()
+        pump_queue()
+
+
+# --- BACKGROUND SCRUB ---
+# One app-wide loop re-verifies stored archives every scrub_interval_hours (settings.json, 0 = off).
+# Pages only display its alerts, so open windows and reloads never start scrubs of their own.
+SCRUB_CHECK_SECONDS = 60
+scrub_alerts = []  # {"message", "type"} for every page to show
+
+
+async def scrub_all():
+    for env_file in get_env_files():
+        done = {"ok": True}
+        async for event in engine.run_scrub(env_file):
+            if event["type"] == "done":
+                done = event
+        if done.get("result") and done["result"]["corrupt"]:
+            corrupt = ", ".join(done["result"]["corrupt"])
+            message = f"🚨 Scrub ({env_file}): corrupt archives: {corrupt}"
+            scrub_alerts.append({"message": message, "type": "negative"})
+        elif done.get("error"):
+            scrub_alerts.append({"message": f"⚠️ Scrub ({env_file}) failed: {done['error']}", "type": "warning"})
+
+
+async def scrub_loop():
+    last_scrub = time.time()
+    while True:
+        await asyncio.sleep(SCRUB_CHECK_SECONDS)
+        # Re-read every time, so a changed interval applies without restarting the app
+        scrub_hours = load_settings().get("scrub_interval_hours", 0)
+        if scrub_hours and time.time() - last_scrub >= scrub_hours * 3600:
+            # Awaited in this single loop, so scrubs never overlap
+            await scrub_all()
+            last_scrub = time.time()
+
+
+app.on_startup(pump_queue)
+app.on_startup(scrub_loop)
+
+
 @ui.page("/")
 def main_page():
     ui.add_head_html(STYLE_CSS)
@@ -302,13 +481,20 @@ def main_page():
             retention_days_input = (
                 ui.number("Retention Days", value=app_settings["retention_days"])
                 .props("outlined dense")
+                .classes("w-full mb-3")
+            )
+            max_jobs_input = (
+                ui.number("Concurrent Backups", value=app_settings.get("max_concurrent_jobs", 2), min=1)
+                .props("outlined dense")
                 .classes("w-full mb-4")
             )
 
             def save_app_settings():
                 app_settings["max_backups"] = int(max_backups_input.value)
                 app_settings["retention_days"] = int(retention_days_input.value)
+                app_settings["max_concurrent_jobs"] = max(1, int(max_jobs_input.value))
                 save_settings(app_settings)
+                pump_queue()
                 ui.notify("Settings Saved", type="positive")
                 retention_label.set_text(
                     f"Retention: {app_settings['max_backups']} files / {app_settings['retention_days']} days"
@@ -394,12 +580,99 @@ def main_page():
 
                 ui.separator().classes("mb-6 opacity-20")
 
-                # LOGS
+                # JOBS
                 with ui.row().classes("w-full justify-between items-end mb-2"):
-                    ui.label("Execution Log").classes("font-bold text-lg")
-                    status_badge = ui.badge("IDLE", color="grey").props("outline rounded")
+                    ui.label("Jobs").classes("font-bold text-lg")
+                    with ui.row().classes("items-center gap-2"):
+                        ui.button("Clear Finished", icon="clear_all", on_click=lambda: clear_finished_jobs()).props(
+                            "flat size=sm color=grey"
+                        )
+                        status_badge = ui.badge("IDLE", color="grey").props("outline rounded")
+
+                job_views = {}  # job id -> the card elements the refresh timer updates
+
+                def update_job_view(job):
+                    view = job_views[job["id"]]
+                    details = []
+                    if job["status"] == "queued":
+                        details.append("Waiting for a free slot")
+                    if job["status"] in RUNNING_JOB_STATUSES and job["phase"]:
+                        details.append(f"Phase: {job['phase']}")
+                    if job["status"] in RUNNING_JOB_STATUSES and job["bps"]:
+                        details.append(f"{engine.format_bytes(job['bps'])}/s")
+                    if job["finished_at"] and job.get("started_at"):
+                        details.append(f"took {job['finished_at'] - job['started_at']:.0f}s")
+                    view["detail"].set_text(" · ".join(details))
+                    view["bar"].set_value(job["progress"])
+
+                    new_lines = job["log_count"] - view["lines"]
+                    if new_lines > 0:
+                        for line in job["log"][-new_lines:]:
+                            view["log"].push(line)
+                    view["lines"] = job["log_count"]
+
+                @ui.refreshable
+                def job_list():
+                    job_views.clear()
+                    theme = THEME_FRAPPE if is_dark.value else THEME_LATTE
+                    if not jobs:
+                        ui.label("No jobs yet. Start a backup to queue it.").classes("text-sm opacity-60")
+
+                    for job in reversed(jobs):
+                        with (
+                            ui.card()
+                            .classes("shadcn-card w-full p-4 no-shadow")
+                            .style(f"background-color: {theme['card']}; border-color: {theme['border']}")
+                        ):
+                            with ui.row().classes("w-full justify-between items-center no-wrap"):
+                                with ui.column().classes("gap-0"):
+                                    title = job["project"] + (" (permanent)" if job["permanent"] else "")
+                                    ui.label(title).classes("font-medium")
+                                    detail = ui.label().classes("text-xs opacity-60")
+                                with ui.row().classes("items-center gap-2"):
+                                    ui.badge(job["status"].upper(), color=JOB_STATUS_COLORS[job["status"]]).props(
+                                        "outline rounded"
+                                    )
+                                    if job["status"] in ("queued", "running"):
+                                        ui.button(icon="stop", on_click=lambda j=job: cancel_job(j)).props(
+                                            "round flat dense color=negative"
+                                        ).tooltip("Cancel")
+                                    elif job["status"] not in ACTIVE_JOB_STATUSES:
+                                        ui.button(icon="replay", on_click=lambda j=job: requeue_job(j)).props(
+                                            "round flat dense"
+                                        ).tooltip("Run again")
+
+                            bar = ui.linear_progress(value=0, show_value=False).classes("mt-2")
+                            job_log = ui.log(max_lines=JOB_LOG_LINES).classes(
+                                "w-full h-32 p-2 text-xs terminal-window terminal-scroll mt-2"
+                            )
+                            job_views[job["id"]] = {
+                                "status": job["status"],
+                                "detail": detail,
+                                "bar": bar,
+                                "log": job_log,
+                                "lines": job["log_count"] - len(job["log"]),
+                            }
+                            update_job_view(job)
+
+                with ui.column().classes("w-full gap-3 mb-6 overflow-auto").style("max-height: 24rem"):
+                    job_list()
+
+                def refresh_jobs():
+                    # Cards are rebuilt when jobs come, go or change status; otherwise only their contents update
+                    if {job["id"]: job["status"] for job in jobs} != {i: v["status"] for i, v in job_views.items()}:
+                        job_list.refresh()
+                    else:
+                        for job in jobs:
+                            update_job_view(job)
 
-                log = ui.log().classes("w-full h-56 p-4 text-xs terminal-window terminal-scroll mb-6 shadow-inner")
+                    running = sum(job["status"] in RUNNING_JOB_STATUSES for job in jobs)
+                    queued = sum(job["status"] == "queued" for job in jobs)
+                    if running or queued:
+                        status_badge.props(f'color=primary label="{running} RUNNING / {queued} QUEUED"')
+                    else:
+                        status_badge.props('color=grey label="IDLE"')
+                    spinner.set_visibility(running > 0)
 
                 # FOOTER
                 with ui.row().classes("w-full justify-between items-center"):
@@ -410,59 +683,39 @@ def main_page():
                     with ui.row().classes("items-center gap-4"):
                         spinner = ui.spinner(size="md").classes("text-primary invisible")
 
+                        ui.button("BACK UP ALL", on_click=lambda: queue_all()).props("outline").classes("px-4 py-2")
                         start_btn = (
                             ui.button("START BACKUP").props("unelevated").classes("px-8 py-2 text-base shadow-sm")
                         )
 
-                        async def run_process():
+                        def queue_backup():
                             if not env_dropdown.value:
                                 ui.notify("Select a project first", type="warning")
                                 return
 
-                            start_btn.disable()
-                            spinner.set_visibility(True)
-                            status_badge.props('color=primary label="RUNNING"')
-                            log.clear()
-                            log.push(f"🚀 Starting backup: {env_dropdown.value}")
-
-                            # --- PORTABLE EXECUTION LOGIC ---
-                            # If running as EXE, call the compiled engine.
-                            # If running as script, call the python file.
-                            if IS_FROZEN:
-                                engine_exe = os.path.join(BASE_DIR, "backup_engine.exe")
-                                cmd = f'"{engine_exe}" --env "{env_dropdown.value}" --non-interactive'
+                            # --- IN-PROCESS ENGINE ---
+                            # Jobs run in engine worker threads, max_concurrent_jobs at a time.
+                            if enqueue_job(env_dropdown.value, is_permanent.value):
+                                ui.notify(f"Queued backup: {env_dropdown.value}", type="positive")
                             else:
-                                cmd = f'"{sys.executable}" backup.py --env "{env_dropdown.value}" --non-interactive'
-
-                            if is_permanent.value:
-                                cmd += " --permanent"
+                                ui.notify(f"{env_dropdown.value} is already queued", type="warning")
 
-                            process = await asyncio.create_subprocess_shell(
-                                cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, cwd=BASE_DIR
-                            )
+                        def queue_all():
+                            queued = [env_file for env_file in get_env_files() if enqueue_job(env_file)]
+                            ui.notify(f"Queued {len(queued)} backups", type="positive" if queued else "warning")
 
-                            if process.stdout:
-                                while True:
-                                    line = await process.stdout.readline()
-                                    if not line:
-                                        break
-                                    log.push(line.decode().strip())
+                        start_btn.on("click", queue_backup)
+                        ui.timer(0.5, refresh_jobs)
 
-                            await process.wait()
-
-                            if process.returncode == 0:
-                                ui.notify("Backup Successful", type="positive")
-                                status_badge.props('color=positive label="SUCCESS"')
-                                log.push("✅ Backup secured.")
-                            else:
-                                ui.notify("Backup Failed", type="negative")
-                                status_badge.props('color=negative label="FAILED"')
-                                log.push("❌ Error. Check logs.")
+                        # Alerts from the background scrub, including those raised before this page was opened
+                        shown_alerts = {"count": 0}
 
-                            start_btn.enable()
-                            spinner.set_visibility(False)
+                        def show_scrub_alerts():
+                            for alert in scrub_alerts[shown_alerts["count"] :]:
+                                ui.notify(alert["message"], type=alert["type"], close_button=True, timeout=0)
+                            shown_alerts["count"] = len(scrub_alerts)
 
-                        start_btn.on("click", run_process)
+                        ui.timer(1, show_scrub_alerts)
 
             # --- AUTHOR FOOTER ---
             with ui.row().classes("w-full justify-center"):